@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Student, Attendance
+from .rollups import DailyStatusCount, MonthlyStudentCount
 
 @admin.register(Student)
 class StudentAdmin(admin.ModelAdmin):
@@ -17,3 +18,17 @@ class AttendanceAdmin(admin.ModelAdmin):
     ordering = ('-date', '-time_in')
     readonly_fields = ('created_at',)
     date_hierarchy = 'date'
+
+@admin.register(DailyStatusCount)
+class DailyStatusCountAdmin(admin.ModelAdmin):
+    list_display = ('date', 'status', 'count')
+    list_filter = ('status',)
+    ordering = ('-date', 'status')
+    date_hierarchy = 'date'
+
+@admin.register(MonthlyStudentCount)
+class MonthlyStudentCountAdmin(admin.ModelAdmin):
+    list_display = ('month', 'student', 'status', 'count')
+    list_filter = ('status', 'month')
+    search_fields = ('student__name', 'student__student_id')
+    ordering = ('-month', 'student')
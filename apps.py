@@ -0,0 +1,27 @@
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+
+
+class FaceappConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'faceapp'
+
+    def ready(self):
+        from .sqlite_profile import apply_sqlite_profile
+        connection_created.connect(apply_sqlite_profile, dispatch_uid='faceapp_sqlite_profile')
+
+        # Every single-row save or delete of attendance, admin edits included, updates the rollups
+        from . import rollups
+        from .models import Attendance
+        pre_save.connect(rollups.attendance_pre_save, sender=Attendance, dispatch_uid='faceapp_rollups_pre_save')
+        post_save.connect(rollups.attendance_saved, sender=Attendance, dispatch_uid='faceapp_rollups_saved')
+        post_delete.connect(rollups.attendance_deleted, sender=Attendance, dispatch_uid='faceapp_rollups_deleted')
+        # ... and drops the dashboard dates and cached chatbot answers built from them
+        from .marking import attendance_changed
+        post_save.connect(attendance_changed, sender=Attendance, dispatch_uid='faceapp_attendance_saved')
+        post_delete.connect(attendance_changed, sender=Attendance, dispatch_uid='faceapp_attendance_deleted')
+
+        # Servers load the detector and gallery now rather than on the first kiosk request
+        from .warmup import maybe_warm_up
+        maybe_warm_up()
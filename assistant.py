@@ -0,0 +1,122 @@
+"""Caching and LLM plumbing for the attendance chatbot.
+
+Everything derived from the attendance data is cached under a data version
+that is bumped whenever attendance changes, so stale entries are simply
+never looked up again.
+"""
+import hashlib
+import re
+import threading
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from .models import Attendance, Student
+from . import rollups
+
+VERSION_KEY = 'chatbot:data_version'
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_data_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def bump_data_version():
+    """Invalidates cached context and answers; called from the Attendance receivers and after bulk writes"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 2, None)
+
+
+def normalize_question(question):
+    """Lowercase, drop punctuation and collapse whitespace so trivial rephrasings share a cache entry"""
+    return ' '.join(re.sub(r'[^\w\s-]', ' ', question.lower()).split())
+
+
+def _answer_key(question, version):
+    digest = hashlib.sha1(normalize_question(question).encode('utf-8')).hexdigest()
+    return f"chatbot:answer:{version}:{digest}"
+
+
+def get_cached_answer(question):
+    return cache.get(_answer_key(question, get_data_version()))
+
+
+def set_cached_answer(question, answer):
+    timeout = getattr(settings, 'CHATBOT_ANSWER_TTL', 600)
+    cache.set(_answer_key(question, get_data_version()), answer, timeout)
+
+
+def build_analytics_context():
+    """(summary, data_table) describing all attendance plus the 100 most recent records"""
+    total_attendance = rollups.total()
+    unique_students = Student.objects.count()
+    date_range = rollups.date_range()
+    status_counts = rollups.status_breakdown()
+    status_summary = ', '.join([f"{s['status']}: {s['count']}" for s in status_counts]) if status_counts else 'No records.'
+
+    summary = f"Total records: {total_attendance}, Unique students: {unique_students}, Status breakdown: {status_summary}."
+    if date_range[0] and date_range[1]:
+        summary += f" Date range: {date_range[0]} to {date_range[1]}."
+
+    # Gather recent attendance records (for detailed context)
+    recent = (Attendance.objects.order_by('-date', '-time_in')
+              .values_list('student__name', 'student__student_id', 'date', 'time_in', 'status')[:100])
+    data_table = '\n'.join([
+        f"{name} | {student_id} | {date.strftime('%Y-%m-%d') if date else ''} | "
+        f"{time_in.strftime('%H:%M:%S') if time_in else ''} | {status or ''}"
+        for name, student_id, date, time_in, status in recent
+    ])
+    return summary, data_table
+
+
+def get_analytics_context():
+    """Cached build_analytics_context() for the current data version"""
+    key = f"chatbot:context:{get_data_version()}"
+    context = cache.get(key)
+    if context is None:
+        context = build_analytics_context()
+        cache.set(key, context, getattr(settings, 'CHATBOT_CONTEXT_TTL', 3600))
+    return context
+
+
+class LocalChatClient:
+    """Offline stand-in with the same chat.completions.create() shape as the OpenAI client"""
+
+    def __init__(self, reply='This is a local test answer.'):
+        self.reply = reply
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.requests.append(kwargs)
+        message = SimpleNamespace(content=self.reply)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def get_llm_client():
+    """Shared chat client: CHATBOT_LLM_CLIENT if set, else OpenAI with OPENAI_API_KEY (None if unset)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                client_path = getattr(settings, 'CHATBOT_LLM_CLIENT', None)
+                if client_path:
+                    _client = import_string(client_path)()
+                else:
+                    api_key = getattr(settings, 'OPENAI_API_KEY', None)
+                    if not api_key:
+                        return None
+                    from openai import OpenAI
+                    _client = OpenAI(api_key=api_key)
+    return _client
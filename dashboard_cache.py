@@ -0,0 +1,39 @@
+"""Cached sources for the dashboard filter dropdowns and students table"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Student, Attendance
+
+DATES_KEY = 'dashboard:attendance_dates'
+STUDENTS_KEY = 'dashboard:students'
+
+
+def _timeout():
+    # Writes invalidate explicitly; the timeout only bounds staleness across processes
+    return getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300)
+
+
+def get_attendance_dates():
+    """Distinct attendance dates, newest first"""
+    dates = cache.get(DATES_KEY)
+    if dates is None:
+        dates = list(Attendance.objects.values_list('date', flat=True).distinct().order_by('-date'))
+        cache.set(DATES_KEY, dates, _timeout())
+    return dates
+
+
+def get_students():
+    """All students ordered by name, shared by the name filter and the students table"""
+    students = cache.get(STUDENTS_KEY)
+    if students is None:
+        students = list(Student.objects.order_by('name'))
+        cache.set(STUDENTS_KEY, students, _timeout())
+    return students
+
+
+def invalidate_attendance_dates():
+    cache.delete(DATES_KEY)
+
+
+def invalidate_students():
+    cache.delete(STUDENTS_KEY)
@@ -0,0 +1,178 @@
+"""Face encoders: how a face in an image becomes a row of the gallery matrix.
+
+FACE_ENCODER picks one:
+
+'face_recognition' (default) is the project's recognizer, the dlib 128-d
+encodings face_utils.recognize_face uses. A face matches when its Euclidean
+distance to the nearest encoding is within FACE_MATCH_TOLERANCE (0.6,
+face_recognition's default), the same decision recognize_face makes. Rows
+are stored as [e, -|e|^2 / 2], so one matrix product gives e.p - |e|^2 / 2
+and the distance follows without a per-row norm.
+
+'pixel' compares equalised 96x96 Haar crops by cosine similarity against
+FACE_MATCH_THRESHOLD. It needs no dlib but is a lighting-sensitive pixel
+comparison, not a face identifier, and its accuracy has not been measured;
+only use it where face_recognition can't be installed, and for the
+synthetic benchmarks.
+
+Every encoder scores higher-is-better, so the gallery, the kiosk sessions and
+the sync endpoint compare scores with threshold() whichever is configured.
+"""
+import threading
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+TEMPLATE_SIZE = (96, 96)
+DEFAULT_MATCH_THRESHOLD = 0.6
+DEFAULT_MATCH_TOLERANCE = 0.6
+ENCODING_SIZE = 128
+
+_detector = None
+_detector_lock = threading.Lock()
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_face_detector():
+    """Load the Haar cascade once and reuse it for every frame"""
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = cv2.CascadeClassifier(
+                    cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    return _detector
+
+
+def to_gray(image):
+    """Convert a BGR array, grayscale array or PIL image to a grayscale array"""
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return image
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return np.asarray(image.convert('L'))
+
+
+def to_rgb(image):
+    """Convert a BGR array, grayscale array or PIL image to a contiguous RGB array"""
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return np.ascontiguousarray(np.asarray(image.convert('RGB')))
+
+
+def detect_faces(image):
+    """Return (x, y, w, h) Haar cascade boxes for every face in an image"""
+    faces = get_face_detector().detectMultiScale(
+        to_gray(image), scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
+    return [tuple(int(v) for v in face) for face in faces]
+
+
+class PixelEncoder:
+    """Equalised, mean-centred 96x96 grayscale crops compared by cosine similarity"""
+
+    name = 'pixel'
+    dimension = TEMPLATE_SIZE[0] * TEMPLATE_SIZE[1]
+    color = False
+
+    def locate(self, image):
+        return detect_faces(image)
+
+    def encode(self, image, box):
+        """Crop, normalize and flatten one face into a unit-length template"""
+        x, y, w, h = box
+        face = cv2.resize(to_gray(image)[y:y + h, x:x + w], TEMPLATE_SIZE, interpolation=cv2.INTER_AREA)
+        face = cv2.equalizeHist(face).astype(np.float32).ravel()
+        face -= face.mean()
+        norm = np.linalg.norm(face)
+        if not norm:
+            return None
+        return face / norm
+
+    def probes(self, templates):
+        return templates
+
+    def scores(self, products, templates):
+        return products
+
+    def threshold(self):
+        return getattr(settings, 'FACE_MATCH_THRESHOLD', DEFAULT_MATCH_THRESHOLD)
+
+    def describe(self, score):
+        return f"score {score:.2f}"
+
+
+class FaceRecognitionEncoder:
+    """face_recognition (dlib) encodings matched by Euclidean distance like recognize_face.
+
+    The score is 1 - distance, so the tolerance becomes a threshold of 1 - tolerance.
+    """
+
+    name = 'face_recognition'
+    dimension = ENCODING_SIZE + 1
+    color = True
+
+    def __init__(self, model='hog', upsample=1, jitters=1):
+        self.model = model
+        self.upsample = upsample
+        self.jitters = jitters
+
+    def locate(self, image):
+        import face_recognition
+        locations = face_recognition.face_locations(
+            to_rgb(image), number_of_times_to_upsample=self.upsample, model=self.model)
+        return [(left, top, right - left, bottom - top) for top, right, bottom, left in locations]
+
+    def encode(self, image, box):
+        """Encoding of the face at box, with -|e|^2 / 2 appended, or None"""
+        import face_recognition
+        x, y, w, h = box
+        encodings = face_recognition.face_encodings(
+            to_rgb(image), known_face_locations=[(y, x + w, y + h, x)], num_jitters=self.jitters)
+        if not len(encodings):
+            return None
+        encoding = np.asarray(encodings[0], dtype=np.float32)
+        return np.append(encoding, -0.5 * float(encoding @ encoding)).astype(np.float32)
+
+    def probes(self, templates):
+        probes = np.array(templates, dtype=np.float32)
+        probes[..., -1] = 1.0
+        return probes
+
+    def scores(self, products, templates):
+        # |p - e|^2 = |p|^2 - 2 (p.e - |e|^2 / 2), with |p|^2 = -2 * p[-1]
+        templates = np.asarray(templates, dtype=np.float32)
+        squared = -2.0 * (templates[..., -1:] + products)
+        return 1.0 - np.sqrt(np.maximum(squared, 0.0))
+
+    def threshold(self):
+        return 1.0 - getattr(settings, 'FACE_MATCH_TOLERANCE', DEFAULT_MATCH_TOLERANCE)
+
+    def describe(self, score):
+        return f"distance {1.0 - score:.2f}"
+
+
+def make_encoder(name):
+    if name == PixelEncoder.name:
+        return PixelEncoder()
+    if name == FaceRecognitionEncoder.name:
+        return FaceRecognitionEncoder(
+            model=getattr(settings, 'FACE_DETECTION_MODEL', 'hog'),
+            upsample=getattr(settings, 'FACE_DETECTION_UPSAMPLE', 1),
+            jitters=getattr(settings, 'FACE_ENCODING_JITTERS', 1),
+        )
+    raise ValueError(f"unknown FACE_ENCODER {name!r}")
+
+
+def get_encoder():
+    """Encoder selected by FACE_ENCODER, built once per setting value"""
+    global _encoder
+    name = getattr(settings, 'FACE_ENCODER', FaceRecognitionEncoder.name)
+    if _encoder is None or _encoder.name != name:
+        with _encoder_lock:
+            if _encoder is None or _encoder.name != name:
+                _encoder = make_encoder(name)
+    return _encoder
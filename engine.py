@@ -0,0 +1,118 @@
+"""Bounded worker pool that runs frame decoding and recognition off the request thread"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import metrics
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+class EngineBusy(Exception):
+    """Raised when every worker is busy and the submission queue is full"""
+
+
+class RecognitionEngine:
+    """Thread pool with a bounded submission queue.
+
+    cv2.imdecode, the Haar cascade and the NumPy matching all release the GIL,
+    so worker threads run in parallel while sharing the in-memory gallery.
+    Threads don't survive fork(), so an engine only serves the process that
+    created it.
+    """
+
+    def __init__(self, workers=None, queue_size=None):
+        self.pid = os.getpid()
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = 2 * self.workers if queue_size is None else queue_size
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='recognition')
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def submit(self, fn, *args):
+        """Queue fn(*args) and return its future, or raise EngineBusy if the queue is full"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise EngineBusy('Recognition queue is full')
+        submitted = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+
+        def task():
+            wait = time.perf_counter() - submitted
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+            metrics.observe('recognition', 'queue_wait', wait)
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                self._slots.release()
+
+        try:
+            return self._executor.submit(task)
+        except BaseException:
+            with self._lock:
+                self._queued -= 1
+            self._slots.release()
+            raise
+
+    def run(self, fn, *args, timeout=None):
+        """Run fn(*args) on a worker and wait for the result"""
+        return self.submit(fn, *args).result(timeout=timeout)
+
+    def stats(self):
+        """Queue depth, worker usage and wait times"""
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'queued': self._queued,
+                'running': self._running,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'avg_wait_ms': round(self._total_wait / started * 1000, 2) if started else 0.0,
+                'max_wait_ms': round(self._max_wait * 1000, 2),
+            }
+
+
+def _reset_after_fork():
+    # A pre-fork server (gunicorn --preload) warms up in the master; each
+    # worker it forks needs its own threads and a lock nobody holds
+    global _engine, _engine_lock
+    _engine = None
+    _engine_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_engine():
+    """Process-wide recognition engine sized from RECOGNITION_WORKERS / RECOGNITION_QUEUE_SIZE"""
+    global _engine
+    if _engine is None or _engine.pid != os.getpid():
+        with _engine_lock:
+            if _engine is None or _engine.pid != os.getpid():
+                _engine = RecognitionEngine(
+                    workers=getattr(settings, 'RECOGNITION_WORKERS', None),
+                    queue_size=getattr(settings, 'RECOGNITION_QUEUE_SIZE', None),
+                )
+    return _engine
@@ -0,0 +1,103 @@
+"""Short-lived cache of recognition results for repeated kiosk frames.
+
+A double-clicked Capture button or an auto-retrying page sends the same face
+again within seconds. Once a worker has found the face, the face crop gets a
+64-bit difference hash (dHash), and a crop whose hash exactly equals one the
+same kiosk sent recently is answered with that crop's result, skipping the
+encoding and matching. Only the face is hashed, and only an exact hash
+counts, because near-matches of whole frames are dominated by the background
+and the next person at the same kiosk would inherit the previous identity.
+
+Entries expire after FRAME_CACHE_TTL seconds, the oldest is evicted beyond
+FRAME_CACHE_SIZE, and an entry only counts while the gallery is unchanged
+since it was stored.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .encoders import to_gray
+
+HASH_SIZE = 8
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def face_hash(image, box):
+    """64-bit difference hash of the face at box (x, y, w, h) in a decoded frame"""
+    x, y, w, h = box
+    face = to_gray(image[y:y + h, x:x + w])
+    small = cv2.resize(face, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class RecentFrames:
+    """LRU of (kiosk, face hash) -> recognition result with a time to live.
+
+    Each kiosk only matches its own frames, so this is also the recent
+    identity seen at every kiosk.
+    """
+
+    def __init__(self, size=256, ttl=5.0):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, kiosk, key, generation):
+        """Result stored for this face hash from kiosk, or None"""
+        now = time.monotonic()
+        with self._lock:
+            for entry_key in [k for k, entry in self._entries.items() if entry[0] <= now]:
+                del self._entries[entry_key]
+            found = self._entries.get((kiosk, key))
+            if found is not None:
+                self._entries.move_to_end((kiosk, key))
+            if found is None or found[1] != generation:
+                self._misses += 1
+                return None
+            self._hits += 1
+            return found[2]
+
+    def put(self, kiosk, key, generation, result):
+        with self._lock:
+            self._entries[(kiosk, key)] = (time.monotonic() + self.ttl, generation, result)
+            self._entries.move_to_end((kiosk, key))
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hits, misses and hit rate since the process started"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def get_frame_cache():
+    """Process-wide cache, or None when FRAME_CACHE_SIZE is 0"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = RecentFrames(
+                    size=getattr(settings, 'FRAME_CACHE_SIZE', 256),
+                    ttl=getattr(settings, 'FRAME_CACHE_TTL', 5.0),
+                )
+    return _cache if _cache.size else None
@@ -0,0 +1,122 @@
+"""Decoding and downscaling of kiosk frames before face detection.
+
+Detection only needs an image of bounded size, so frames are decoded at a
+reduced resolution where the JPEG decoder can do it for free
+(IMREAD_REDUCED_*), and then resized so the longest side is at most
+FRAME_MAX_DIMENSION. Frames are decoded straight to grayscale unless the
+configured encoder needs color, as face_recognition does.
+"""
+import struct
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .encoders import get_encoder
+
+DEFAULT_MAX_DIMENSION = 640
+DEFAULT_ROI_MARGIN = 0.25
+REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
+REDUCED_COLOR_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+# Start-of-frame markers carrying the image size (not DHT, JPG or DAC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def image_size(data):
+    """(width, height) read from a JPEG or PNG header, or None for anything else"""
+    data = memoryview(data)
+    if bytes(data[:8]) == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+    if bytes(data[:2]) != b'\xff\xd8':
+        return None
+    pos = 2
+    while pos + 9 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + struct.unpack('>H', data[pos + 2:pos + 4])[0]
+    return None
+
+
+def parse_roi(value):
+    """(x, y, w, h) from an 'x,y,w,h' hint, or None if it is missing or malformed"""
+    if not value:
+        return None
+    try:
+        x, y, w, h = (int(float(v)) for v in value.split(','))
+    except ValueError:
+        return None
+    if w <= 0 or h <= 0:
+        return None
+    return x, y, w, h
+
+
+class PreparedFrame:
+    """A decoded frame and how to map its coordinates back to the uploaded one"""
+
+    def __init__(self, image, scale, region=None):
+        self.image = image
+        self.scale = scale
+        self.region = region
+
+    def to_original(self, box):
+        """Scale a box found in image back to the uploaded frame's pixels"""
+        return tuple(int(round(v * self.scale)) for v in box)
+
+
+def prepare_frame(img_bytes, roi=None, color=None):
+    """Decode an encoded frame for detection; roi is an optional face hint in uploaded-frame pixels.
+
+    color defaults to what the configured encoder needs.
+    """
+    max_dimension = getattr(settings, 'FRAME_MAX_DIMENSION', DEFAULT_MAX_DIMENSION)
+    buf = np.frombuffer(img_bytes, np.uint8)
+    if color is None:
+        color = get_encoder().color
+
+    flag, factor = (cv2.IMREAD_COLOR if color else cv2.IMREAD_GRAYSCALE), 1
+    size = image_size(buf) if max_dimension and getattr(settings, 'FRAME_REDUCED_DECODE', True) else None
+    if size:
+        for candidate, reduced_flag in (REDUCED_COLOR_FLAGS if color else REDUCED_FLAGS):
+            if max(size) // candidate >= max_dimension:
+                flag, factor = reduced_flag, candidate
+                break
+    image = cv2.imdecode(buf, flag)
+    if image is None:
+        raise ValueError('could not decode frame')
+    scale = float(factor)
+    if size:
+        # The reduced decoders round up, so measure the real factor
+        scale = size[0] / image.shape[1]
+
+    if max_dimension and max(image.shape[:2]) > max_dimension:
+        shrink = max_dimension / max(image.shape[:2])
+        image = cv2.resize(image, (max(1, round(image.shape[1] * shrink)), max(1, round(image.shape[0] * shrink))),
+                           interpolation=cv2.INTER_AREA)
+        scale /= shrink
+
+    region = None
+    if roi is not None:
+        margin = getattr(settings, 'FRAME_ROI_MARGIN', DEFAULT_ROI_MARGIN)
+        x, y, w, h = (v / scale for v in roi)
+        x0 = max(0, int(x - w * margin))
+        y0 = max(0, int(y - h * margin))
+        x1 = min(image.shape[1], int(x + w * (1 + margin)))
+        y1 = min(image.shape[0], int(y + h * (1 + margin)))
+        if x1 > x0 and y1 > y0:
+            region = (x0, y0, x1 - x0, y1 - y0)
+    return PreparedFrame(image, scale, region)
@@ -0,0 +1,499 @@
+"""Gallery of known face templates, shared by the whole process and published for other workers"""
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+from .encoders import get_encoder
+
+IMAGE_EXTENSIONS = ('.jpeg', '.jpg', '.png')
+
+_gallery = None
+_gallery_lock = threading.Lock()
+
+
+def get_known_faces_dir():
+    """Directory holding the enrolment photos used for recognition"""
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_dir, 'known_faces')
+
+
+def get_snapshot_dir():
+    """Directory holding the published gallery snapshots (FACE_GALLERY_SNAPSHOT_DIR)"""
+    return getattr(settings, 'FACE_GALLERY_SNAPSHOT_DIR', None) or os.path.join(get_known_faces_dir(), 'gallery')
+
+
+def match_threshold():
+    """Lowest score the configured encoder counts as a match"""
+    return get_encoder().threshold()
+
+
+def face_template(image, box, encoder=None):
+    """Template of the face at box (x, y, w, h), or None if it can't be encoded"""
+    return (encoder or get_encoder()).encode(image, box)
+
+
+def compute_template(image, encoder=None):
+    """Return the template of the largest face in image, or None if there is no face"""
+    encoder = encoder or get_encoder()
+    faces = encoder.locate(image)
+    if not faces:
+        return None
+    box = max(faces, key=lambda f: f[2] * f[3])
+    return encoder.encode(image, box)
+
+
+def enrolment_template(path, encoder=None):
+    """(template, face_count) for an enrolment photo; face_count is None if it can't be read.
+
+    Only returns a template when exactly one face is found. With an encoder
+    passed in it needs nothing from Django, so it can run in a worker process.
+    """
+    encoder = encoder or get_encoder()
+    img = cv2.imread(path)
+    if img is None:
+        return None, None
+    faces = encoder.locate(img)
+    if len(faces) != 1:
+        return None, len(faces)
+    template = encoder.encode(img, faces[0])
+    return template, 1 if template is not None else 0
+
+
+class PartitionedIndex:
+    """Coarse k-means partitions over a template matrix for approximate search"""
+
+    def __init__(self, matrix, nlist, iterations=8, seed=0):
+        count = len(matrix)
+        nlist = max(1, min(nlist, count))
+        rng = np.random.default_rng(seed)
+        # Centroids are trained on a sample; every row is assigned afterwards
+        sample = matrix[rng.choice(count, min(count, 32 * nlist), replace=False)]
+        centroids = sample[:nlist].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            members = np.zeros((nlist, len(sample)), dtype=np.float32)
+            members[assignment, np.arange(len(sample))] = 1
+            sums = members @ sample
+            norms = np.linalg.norm(sums, axis=1)
+            filled = norms > 0
+            centroids[filled] = sums[filled] / norms[filled, None]
+        assignment = np.argmax(matrix @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(nlist + 1))
+        self.size = count
+        self.centroids = np.ascontiguousarray(centroids)
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(nlist)]
+
+    def candidates(self, probe, nprobe):
+        """Row numbers in the nprobe partitions closest to probe"""
+        nprobe = min(nprobe, len(self.lists))
+        nearest = np.argpartition(-(self.centroids @ probe), nprobe - 1)[:nprobe]
+        return np.concatenate([self.lists[c] for c in nearest])
+
+
+class FaceGallery:
+    """Precomputed face templates stored as one contiguous matrix, one row per student.
+
+    With a store (a gallery_store.SnapshotStore), every change is published
+    as a new snapshot and the matrix is memory-mapped from it, so all
+    workers share the templates and refresh() picks up other workers' changes.
+    Snapshots made by a different encoder are ignored and rebuilt by load().
+    """
+
+    def __init__(self, store=None, encoder=None):
+        self.store = store
+        self.encoder = encoder or get_encoder()
+        self._matrix = np.empty((0, self.encoder.dimension), dtype=np.float32)
+        self._count = 0
+        self._ids = []
+        self._rows = {}
+        # When each template was computed, and photos without a usable face
+        self._stamps = {}
+        self._skipped = {}
+        self._index = None
+        self._generation = 0
+        self._version = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, student_id):
+        return student_id in self._rows
+
+    @property
+    def version(self):
+        """Snapshot version currently mapped, or None"""
+        return self._version
+
+    @property
+    def generation(self):
+        """Changes whenever the templates do"""
+        return self._generation
+
+    def _snapshot(self):
+        # Appends only write rows past _count and removals swap in new
+        # arrays, so a snapshot stays consistent without holding the lock
+        with self._lock:
+            return self._matrix[:self._count], self._ids, self._index, self._generation
+
+    def _map(self, version):
+        """Swap in a published snapshot; returns False if it can't be read"""
+        snapshot = self.store.read(version)
+        if snapshot is None:
+            return False
+        matrix, ids, stamps, skipped, encoder = snapshot
+        if encoder != self.encoder.name or matrix.shape[1] != self.encoder.dimension:
+            return False
+        with self._lock:
+            self._matrix = matrix
+            self._count = len(ids)
+            self._ids = list(ids)
+            self._rows = {student_id: row for row, student_id in enumerate(ids)}
+            self._stamps = dict(zip(ids, stamps))
+            self._skipped = dict(skipped)
+            self._index = None
+            self._generation += 1
+            self._version = version
+        return True
+
+    def refresh(self, force=False):
+        """Map the latest snapshot if another worker published one.
+
+        The version stamp is checked at most every FACE_GALLERY_RELOAD_INTERVAL seconds.
+        """
+        if self.store is None:
+            return False
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+        self._next_check = now + getattr(settings, 'FACE_GALLERY_RELOAD_INTERVAL', 1.0)
+        version = self.store.current_version()
+        if version is None or version == self._version:
+            return False
+        return self._map(version)
+
+    def _update(self, change):
+        """Apply change() on top of the latest snapshot and publish the result if it returns True"""
+        if self.store is None:
+            return change()
+        with self.store.locked():
+            self.refresh(force=True)
+            changed = change()
+            if changed:
+                with self._lock:
+                    matrix = self._matrix[:self._count]
+                    ids = list(self._ids)
+                    stamps = [self._stamps.get(student_id, 0.0) for student_id in ids]
+                    skipped = dict(self._skipped)
+                self._map(self.store.write(matrix, ids, stamps, skipped, self.encoder.name))
+            return changed
+
+    def load(self, known_faces_dir):
+        """Load templates for every photo in known_faces_dir, replacing the current ones.
+
+        Templates in the latest snapshot are reused unless the photo changed
+        since; other photos are processed and, if anything changed, a new
+        snapshot is published.
+        """
+        def change():
+            photos = {}
+            if os.path.isdir(known_faces_dir):
+                for filename in sorted(os.listdir(known_faces_dir)):
+                    if filename.lower().endswith(IMAGE_EXTENSIONS):
+                        photos[os.path.splitext(filename)[0]] = filename
+            templates, stamps, skipped = {}, {}, {}
+            for student_id, filename in photos.items():
+                photo_path = os.path.join(known_faces_dir, filename)
+                try:
+                    mtime = os.path.getmtime(photo_path)
+                except OSError:
+                    continue
+                row = self._rows.get(student_id)
+                if row is not None and self._stamps.get(student_id, 0.0) >= mtime:
+                    templates[student_id] = self._matrix[row]
+                    stamps[student_id] = self._stamps[student_id]
+                    continue
+                if self._skipped.get(filename, 0.0) >= mtime:
+                    skipped[filename] = self._skipped[filename]
+                    continue
+                stamp = time.time()
+                img = cv2.imread(photo_path)
+                template = compute_template(img, self.encoder) if img is not None else None
+                if template is None:
+                    if img is not None:
+                        print(f"No face found in {filename}, skipping")
+                    skipped[filename] = stamp
+                    continue
+                templates[student_id] = template
+                stamps[student_id] = stamp
+
+            if (stamps == {student_id: self._stamps.get(student_id) for student_id in self._ids}
+                    and skipped == self._skipped):
+                # Keep the mapped snapshot rather than a private copy of it
+                return False
+            self.replace(templates, stamps)
+            self._skipped = skipped
+            return True
+        self._update(change)
+
+    def replace(self, templates, stamps=None):
+        """Swap in a complete {student_id: template} mapping"""
+        ids = list(templates)
+        matrix = np.empty((len(ids), self._matrix.shape[1]), dtype=np.float32)
+        for row, student_id in enumerate(ids):
+            matrix[row] = templates[student_id]
+        with self._lock:
+            self._matrix = matrix
+            self._count = len(ids)
+            self._ids = ids
+            self._rows = {student_id: row for row, student_id in enumerate(ids)}
+            self._stamps = dict(stamps or {})
+            self._index = None
+            self._generation += 1
+
+    def add(self, student_id, image):
+        """Compute, store and publish the template for a newly enrolled student"""
+        stamp = time.time()
+        template = compute_template(image, self.encoder)
+        if template is None:
+            return False
+        self.add_templates({student_id: template}, stamp)
+        return True
+
+    def add_templates(self, templates, stamp=None):
+        """Store and publish precomputed {student_id: template} in one snapshot"""
+        stamp = time.time() if stamp is None else stamp
+
+        def change():
+            for student_id, template in templates.items():
+                self.add_template(student_id, template)
+                self._stamps[student_id] = stamp
+            return bool(templates)
+        self._update(change)
+
+    def add_template(self, student_id, template):
+        """Store a precomputed template, overwriting any previous one for student_id"""
+        with self._lock:
+            row = self._rows.get(student_id)
+            if row is not None:
+                matrix = self._matrix.copy()
+                matrix[row] = template
+                self._matrix = matrix
+                self._index = None
+                self._generation += 1
+                return
+            if self._count == len(self._matrix):
+                grown = np.empty((max(16, 2 * self._count), self._matrix.shape[1]), dtype=np.float32)
+                grown[:self._count] = self._matrix[:self._count]
+                self._matrix = grown
+            self._matrix[self._count] = template
+            self._ids.append(student_id)
+            self._rows[student_id] = self._count
+            self._count += 1
+
+    def remove(self, student_id, known_faces_dir=None):
+        """Drop and publish the removal of a student's template; returns True if one was stored.
+
+        With known_faces_dir, the student's enrolment photos are deleted under
+        the same lock, so no worker's load() can bring the template back.
+        """
+        def change():
+            if known_faces_dir is not None:
+                self._delete_photos(known_faces_dir, student_id)
+            return self._remove(student_id)
+        return self._update(change)
+
+    def _delete_photos(self, known_faces_dir, student_id):
+        if not os.path.isdir(known_faces_dir):
+            return
+        for filename in os.listdir(known_faces_dir):
+            name, ext = os.path.splitext(filename)
+            if name == student_id and ext.lower() in IMAGE_EXTENSIONS:
+                os.remove(os.path.join(known_faces_dir, filename))
+                self._skipped.pop(filename, None)
+
+    def _remove(self, student_id):
+        with self._lock:
+            self._stamps.pop(student_id, None)
+            row = self._rows.pop(student_id, None)
+            if row is None:
+                return False
+            last = self._count - 1
+            matrix = self._matrix[:self._count].copy()
+            ids = list(self._ids)
+            if row != last:
+                matrix[row] = matrix[last]
+                ids[row] = ids[last]
+                self._rows[ids[row]] = row
+            self._matrix = matrix[:last]
+            self._ids = ids[:last]
+            self._count = last
+            self._index = None
+            self._generation += 1
+            return True
+
+    def clear(self):
+        """Forget every template and publish the empty gallery"""
+        def change():
+            self.replace({})
+            self._skipped = {}
+            return True
+        self._update(change)
+
+    def _ann_index(self, matrix, index, generation):
+        """Partitioned index over matrix, rebuilt once too many rows are unindexed"""
+        if index is not None and len(matrix) - index.size <= index.size // 10:
+            return index
+        nlist = getattr(settings, 'FACE_GALLERY_ANN_NLIST', None) or int(np.sqrt(len(matrix)))
+        index = PartitionedIndex(matrix, nlist)
+        with self._lock:
+            if self._generation == generation:
+                self._index = index
+        return index
+
+    def search(self, template, k=1, exact=None):
+        """Top-k (student_id, score) pairs for a template, best first"""
+        matrix, ids, index, generation = self._snapshot()
+        if not len(matrix):
+            return []
+        template = np.asarray(template, dtype=np.float32)
+        probe = self.encoder.probes(template)
+        if exact is None:
+            exact = getattr(settings, 'FACE_GALLERY_SEARCH', 'exact') != 'ann'
+        ann_min_size = getattr(settings, 'FACE_GALLERY_ANN_MIN_SIZE', 2000)
+
+        if exact or len(matrix) < ann_min_size:
+            rows = None
+            products = matrix @ probe
+        else:
+            index = self._ann_index(matrix, index, generation)
+            nprobe = getattr(settings, 'FACE_GALLERY_ANN_NPROBE', 8)
+            # Rows enrolled since the index was built are always searched exactly
+            rows = np.concatenate([
+                index.candidates(probe, nprobe),
+                np.arange(index.size, len(matrix)),
+            ])
+            products = matrix[rows] @ probe
+        scores = self.encoder.scores(products, template)
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if rows is not None:
+            return [(ids[rows[i]], float(scores[i])) for i in top]
+        return [(ids[i], float(scores[i])) for i in top]
+
+    def search_many(self, templates, k=1, exact=None):
+        """Top-k (student_id, score) pairs for each row of templates, scored in one batch"""
+        if exact is None:
+            exact = getattr(settings, 'FACE_GALLERY_SEARCH', 'exact') != 'ann'
+        matrix, ids, _, _ = self._snapshot()
+        if not exact and len(matrix) >= getattr(settings, 'FACE_GALLERY_ANN_MIN_SIZE', 2000):
+            return [self.search(template, k, exact=False) for template in templates]
+        if not len(matrix):
+            return [[] for _ in templates]
+
+        templates = np.asarray(templates, dtype=np.float32)
+        scores = self.encoder.scores(self.encoder.probes(templates) @ matrix.T, templates)
+        k = min(k, len(matrix))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in zip(scores, top):
+            candidates = candidates[np.argsort(-row[candidates])]
+            results.append([(ids[i], float(row[i])) for i in candidates])
+        return results
+
+    def match_all(self, image):
+        """Identify every face in image, returning (box, student_id or None, score) per face"""
+        with metrics.timed('recognition', 'detect'):
+            boxes = self.encoder.locate(image)
+        with metrics.timed('recognition', 'encode'):
+            faces = []
+            for box in boxes:
+                template = self.encoder.encode(image, box)
+                if template is not None:
+                    faces.append((box, template))
+        if not faces:
+            return []
+
+        threshold = self.encoder.threshold()
+        with metrics.timed('recognition', 'match'):
+            matches = self.search_many([t for _, t in faces])
+        results = []
+        for (box, _), candidates in zip(faces, matches):
+            if candidates and candidates[0][1] >= threshold:
+                results.append((box, candidates[0][0], candidates[0][1]))
+            else:
+                results.append((box, None, candidates[0][1] if candidates else 0.0))
+        return results
+
+    def find_face(self, image, region=None):
+        """(x, y, w, h) of the largest face in image, searching region first; None without a face"""
+        if region is not None:
+            x, y, w, h = region
+            faces = self.encoder.locate(image[y:y + h, x:x + w])
+            if faces:
+                fx, fy, fw, fh = max(faces, key=lambda f: f[2] * f[3])
+                return fx + x, fy + y, fw, fh
+        faces = self.encoder.locate(image)
+        if not faces:
+            return None
+        return max(faces, key=lambda f: f[2] * f[3])
+
+    def match(self, image, k=None, region=None, with_score=False, box=None):
+        """Identify the face in image, returning (student_id, info) like recognize_face.
+
+        region (x, y, w, h) is a hint where the face is; it is searched first
+        and the whole image only if no face is found there. box is a face
+        already found by find_face(), skipping detection. with_score adds the
+        best match score (None without a face or gallery) as a third item.
+        """
+        def result(student_id, info, score=None):
+            return (student_id, info, score) if with_score else (student_id, info)
+
+        if box is None:
+            with metrics.timed('recognition', 'detect'):
+                box = self.find_face(image, region)
+        with metrics.timed('recognition', 'encode'):
+            template = self.encoder.encode(image, box) if box is not None else None
+        if template is None:
+            return result(None, 'No face detected')
+        if not self._count:
+            return result(None, 'No known faces enrolled')
+
+        if k is None:
+            k = getattr(settings, 'FACE_MATCH_TOP_K', 1)
+        started = time.perf_counter()
+        candidates = self.search(template, k)
+        elapsed = time.perf_counter() - started
+        metrics.observe('recognition', 'match', elapsed)
+        elapsed_ms = elapsed * 1000
+        best_id, best_score = candidates[0]
+
+        described = self.encoder.describe(best_score)
+        if best_score < self.encoder.threshold():
+            return result(None, (f"closest match {best_id} is below threshold "
+                                 f"({described}, match {elapsed_ms:.1f} ms)"), best_score)
+        return result(best_id, f"matched {best_id} ({described}, match {elapsed_ms:.1f} ms)", best_score)
+
+
+def get_gallery():
+    """Process-wide gallery, loaded on first use and kept in step with the published snapshot"""
+    global _gallery
+    if _gallery is None:
+        with _gallery_lock:
+            if _gallery is None:
+                from .gallery_store import SnapshotStore
+                gallery = FaceGallery(store=SnapshotStore(get_snapshot_dir()))
+                gallery.load(get_known_faces_dir())
+                _gallery = gallery
+                return _gallery
+    _gallery.refresh()
+    return _gallery
@@ -0,0 +1,128 @@
+"""Versioned on-disk snapshots of the face gallery, shared by every worker.
+
+A snapshot is a template matrix (gallery-<version>.npy) plus its id table
+(gallery-<version>.json), which also names the encoder that made the
+templates. CURRENT holds the live version number and is only replaced once
+both files are complete, so a reader never sees half a snapshot. Readers
+memory-map the matrix read-only, so every worker on a machine shares one
+copy in the page cache, and reload when CURRENT changes.
+
+Writers hold LOCK while they apply their change to the latest snapshot and
+publish the next version, so registrations in different workers or on
+different nodes sharing the directory don't overwrite each other.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+KEEP_VERSIONS = 3
+
+
+class SnapshotStore:
+    """Directory of gallery snapshots with an atomically replaced version stamp"""
+
+    def __init__(self, directory, lock_timeout=30.0, stale_lock=120.0):
+        self.directory = directory
+        self.lock_timeout = lock_timeout
+        self.stale_lock = stale_lock
+        self._thread_lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _version_path(self, version, ext):
+        return self._path(f"gallery-{version:08d}{ext}")
+
+    def current_version(self):
+        """Version number in CURRENT, or None if nothing has been published"""
+        try:
+            with open(self._path('CURRENT')) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def read(self, version):
+        """(matrix, ids, stamps, skipped, encoder) of a version with the matrix memory-mapped, or None if unusable"""
+        try:
+            with open(self._version_path(version, '.json'), encoding='utf-8') as f:
+                table = json.load(f)
+            matrix = np.load(self._version_path(version, '.npy'), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        ids = table.get('ids', [])
+        if matrix.ndim != 2 or len(matrix) != len(ids):
+            return None
+        return (matrix, ids, table.get('stamps', [0.0] * len(ids)), table.get('skipped', {}),
+                table.get('encoder', 'pixel'))
+
+    def _write_file(self, path, write):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def write(self, matrix, ids, stamps, skipped, encoder):
+        """Publish a new version and return its number; call with the lock held"""
+        os.makedirs(self.directory, exist_ok=True)
+        version = (self.current_version() or 0) + 1
+        table = {'version': version, 'encoder': encoder, 'ids': list(ids), 'stamps': list(stamps),
+                 'skipped': skipped}
+        self._write_file(self._version_path(version, '.npy'),
+                         lambda f: np.save(f, np.ascontiguousarray(matrix, dtype=np.float32)))
+        self._write_file(self._version_path(version, '.json'),
+                         lambda f: f.write(json.dumps(table).encode('utf-8')))
+        self._write_file(self._path('CURRENT'), lambda f: f.write(str(version).encode('ascii')))
+        self._prune(version)
+        return version
+
+    def _prune(self, version):
+        """Delete versions too old for any worker to still be switching to"""
+        for filename in os.listdir(self.directory):
+            if not filename.startswith('gallery-') or filename.endswith('.tmp'):
+                continue
+            try:
+                old = int(filename[len('gallery-'):].split('.')[0])
+            except ValueError:
+                continue
+            if old <= version - KEEP_VERSIONS:
+                try:
+                    os.remove(self._path(filename))
+                except OSError:
+                    # Still mapped by a worker on Windows; removed next time
+                    pass
+
+    @contextmanager
+    def locked(self):
+        """Hold the writer lock, shared by threads, processes and nodes using the directory"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path('LOCK')
+        deadline = time.monotonic() + self.lock_timeout
+        with self._thread_lock:
+            while True:
+                try:
+                    fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                    break
+                except FileExistsError:
+                    try:
+                        if time.time() - os.path.getmtime(path) > self.stale_lock:
+                            # Left behind by a writer that died
+                            os.remove(path)
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"gallery snapshot lock {path} is held by another writer")
+                    time.sleep(0.05)
+            try:
+                os.write(fd, str(os.getpid()).encode('ascii'))
+                os.close(fd)
+                yield
+            finally:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
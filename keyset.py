@@ -0,0 +1,63 @@
+"""Keyset pagination over (date, time_in, id), newest first"""
+from datetime import date, time
+
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 50
+
+
+def encode_cursor(record):
+    return f"{record.date.isoformat()}_{record.time_in.isoformat()}_{record.id}"
+
+
+def decode_cursor(cursor):
+    """Parse a cursor into (date, time, id); returns None for anything malformed"""
+    try:
+        day, time_in, pk = cursor.split('_')
+        return date.fromisoformat(day), time.fromisoformat(time_in), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+# The leading date bound is implied by the OR, but it lets the database seek
+# the (date, time_in, id) index to the cursor instead of scanning from one end.
+
+def older_than(key):
+    day, time_in, pk = key
+    return Q(date__lte=day) & (
+        Q(date__lt=day) | Q(date=day, time_in__lt=time_in) | Q(date=day, time_in=time_in, id__lt=pk))
+
+
+def newer_than(key):
+    day, time_in, pk = key
+    return Q(date__gte=day) & (
+        Q(date__gt=day) | Q(date=day, time_in__gt=time_in) | Q(date=day, time_in=time_in, id__gt=pk))
+
+
+def keyset_page(queryset, after=None, before=None, page_size=DEFAULT_PAGE_SIZE):
+    """One page of queryset plus cursors for the neighbouring pages.
+
+    Each page is a range scan on the (date, time_in, id) index from migration
+    0007 that reads page_size + 1 rows, so the cost stays the same however
+    deep into the table the page is.
+    Returns (records, next_cursor, previous_cursor).
+    """
+    after_key = decode_cursor(after) if after else None
+    before_key = decode_cursor(before) if before else None
+
+    if before_key:
+        rows = list(queryset.filter(newer_than(before_key)).order_by('date', 'time_in', 'id')[:page_size + 1])
+        has_newer = len(rows) > page_size
+        records = list(reversed(rows[:page_size]))
+        has_older = True
+    else:
+        if after_key:
+            queryset = queryset.filter(older_than(after_key))
+        rows = list(queryset.order_by('-date', '-time_in', '-id')[:page_size + 1])
+        has_older = len(rows) > page_size
+        records = rows[:page_size]
+        has_newer = after_key is not None
+
+    next_cursor = encode_cursor(records[-1]) if records and has_older else None
+    previous_cursor = encode_cursor(records[0]) if records and has_newer else None
+    return records, next_cursor, previous_cursor
@@ -0,0 +1,278 @@
+"""Hands-free kiosk mode: a WebSocket stream of frames with face tracking.
+
+The page sends a few JPEG frames per second over one WebSocket. Faces are
+detected on every frame and followed from frame to frame by box overlap, but
+templates are only computed and matched for new tracks and for tracks whose
+identity is unknown or weak, so a student standing in front of the camera
+costs one recognition instead of one per frame. When a track is identified
+the student is marked and a "marked" event is pushed back to the page.
+
+Django has no WebSocket support of its own, so this is a plain ASGI
+application; with_kiosk_websocket() puts it in front of Django's ASGI handler
+in the project's asgi.py. Any ASGI server with WebSocket support (uvicorn,
+daphne, hypercorn) can serve it.
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import metrics
+from .engine import get_engine, EngineBusy
+from .frames import prepare_frame
+from .encoders import get_encoder
+from .gallery import get_gallery
+from .marking import mark_student_present
+from .sheets import get_sheet_writer
+
+KIOSK_WS_PATH = '/ws/kiosk/'
+
+
+def iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / (aw * ah + bw * bh - inter)
+
+
+class Track:
+    """One face followed across frames"""
+
+    def __init__(self, track_id, box):
+        self.id = track_id
+        self.box = box
+        self.student_id = None
+        self.name = None
+        self.score = 0.0
+        self.misses = 0
+        self.checked_at = None
+        self.marked = None
+
+
+class FaceTracker:
+    """Greedy IoU tracker deciding which faces need (re)recognition"""
+
+    def __init__(self, iou_threshold=0.3, max_misses=5, recheck_frames=5, confident_score=0.7):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.recheck_frames = recheck_frames
+        self.confident_score = confident_score
+        self.tracks = []
+        self.frame_no = 0
+        self._next_id = 1
+
+    def update(self, boxes):
+        """Match this frame's boxes to tracks; returns the tracks that need recognition"""
+        self.frame_no += 1
+        pairs = sorted(
+            ((iou(track.box, box), t, b) for t, track in enumerate(self.tracks) for b, box in enumerate(boxes)),
+            reverse=True
+        )
+        matched_tracks, matched_boxes = set(), set()
+        for overlap, t, b in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if t in matched_tracks or b in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes.add(b)
+            self.tracks[t].box = boxes[b]
+            self.tracks[t].misses = 0
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        for b, box in enumerate(boxes):
+            if b not in matched_boxes:
+                self.tracks.append(Track(self._next_id, box))
+                self._next_id += 1
+
+        return [track for track in self.tracks if track.misses == 0 and self._needs_recognition(track)]
+
+    def _needs_recognition(self, track):
+        if track.checked_at is None:
+            return True
+        if track.student_id is not None and track.score >= self.confident_score:
+            return False
+        return self.frame_no - track.checked_at >= self.recheck_frames
+
+    def visible(self):
+        return [track for track in self.tracks if track.misses == 0]
+
+
+class KioskSession:
+    """Tracking state for one connected kiosk"""
+
+    def __init__(self, kiosk_id=''):
+        self.kiosk_id = kiosk_id
+        self.encoder = get_encoder()
+        self.threshold = self.encoder.threshold()
+        self.tracker = FaceTracker(
+            iou_threshold=getattr(settings, 'KIOSK_IOU_THRESHOLD', 0.3),
+            max_misses=getattr(settings, 'KIOSK_MAX_MISSES', 5),
+            recheck_frames=getattr(settings, 'KIOSK_RECHECK_FRAMES', 5),
+            confident_score=getattr(settings, 'KIOSK_CONFIDENT_SCORE', self.threshold + 0.1),
+        )
+        self.frames = 0
+        self.recognitions = 0
+
+    def process(self, img_bytes):
+        """Detect and track faces in one frame, recognizing only where needed; runs on a recognition worker.
+
+        Returns (frame, tracks to mark).
+        """
+        with metrics.timed('kiosk', 'decode'):
+            frame = prepare_frame(img_bytes)
+        with metrics.timed('kiosk', 'detect'):
+            boxes = self.encoder.locate(frame.image)
+        pending = self.tracker.update(boxes)
+        self.frames += 1
+
+        templates, tracks = [], []
+        for track in pending:
+            template = self.encoder.encode(frame.image, track.box)
+            if template is not None:
+                templates.append(template)
+                tracks.append(track)
+        if templates:
+            with metrics.timed('kiosk', 'match'):
+                matches = get_gallery().search_many(np.asarray(templates))
+            self.recognitions += len(templates)
+            metrics.inc('kiosk', 'recognitions', len(templates))
+            for track, candidates in zip(tracks, matches):
+                if candidates and candidates[0][1] >= self.threshold:
+                    track.student_id, track.score = candidates[0]
+                else:
+                    track.student_id, track.name = None, None
+                    track.score = candidates[0][1] if candidates else 0.0
+        # Only once matching has succeeded, so a failed frame is retried on the next
+        for track in pending:
+            track.checked_at = self.tracker.frame_no
+        metrics.inc('kiosk', 'frames')
+
+        to_mark = [track for track in self.tracker.visible()
+                   if track.student_id is not None and track.marked != track.student_id]
+        return frame, to_mark
+
+    def describe(self, frame):
+        return [{
+            'track': track.id,
+            'box': list(frame.to_original(track.box)),
+            'student_id': track.student_id,
+            'name': track.name,
+            'score': round(track.score, 3),
+        } for track in self.tracker.visible()]
+
+
+def mark_track(student_id):
+    """mark_student_present() for the event loop: fresh DB connection handling, sheet row on success"""
+    close_old_connections()
+    try:
+        today = timezone.now().date()
+        name, created = mark_student_present(student_id, today)
+        if created:
+            try:
+                get_sheet_writer().enqueue([[name, today.strftime('%Y-%m-%d'), timezone.now().strftime('%H:%M:%S')]])
+            except Exception as e:
+                print(f"Google Sheets error: {e}")
+        return name, created
+    finally:
+        close_old_connections()
+
+
+async def kiosk_websocket(scope, receive, send):
+    """ASGI WebSocket handler: binary JPEG frames in, JSON 'faces', 'marked' and 'mark_failed' events out"""
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    session = KioskSession(query.get('kiosk', [''])[0])
+    engine = get_engine()
+    mark = sync_to_async(mark_track, thread_sensitive=True)
+
+    async def send_json(payload):
+        await send({'type': 'websocket.send', 'text': json.dumps(payload)})
+
+    while True:
+        message = await receive()
+        if message['type'] == 'websocket.disconnect':
+            return
+        data = message.get('bytes')
+        if message['type'] != 'websocket.receive' or not data:
+            continue
+
+        try:
+            with metrics.timed('kiosk', 'frame'):
+                frame, to_mark = await asyncio.wrap_future(engine.submit(session.process, data))
+        except EngineBusy:
+            # Dropping a frame is harmless in a stream; the next one is a moment away
+            metrics.inc('kiosk', 'busy')
+            await send_json({'type': 'busy'})
+            continue
+        except ValueError as e:
+            await send_json({'type': 'error', 'message': str(e)})
+            continue
+        except Exception as e:
+            # One failed frame mustn't end the kiosk's session
+            print(f"Kiosk frame error: {e}")
+            metrics.inc('kiosk', 'error')
+            await send_json({'type': 'error', 'message': 'Error processing frame.'})
+            continue
+
+        for track in to_mark:
+            student_id = track.student_id
+            try:
+                name, created = await mark(student_id)
+            except Exception as e:
+                # e.g. "database is locked"; the track stays unmarked and is tried again next frame
+                print(f"Kiosk marking error for {student_id}: {e}")
+                metrics.inc('kiosk', 'mark_error')
+                await send_json({
+                    'type': 'mark_failed',
+                    'student_id': student_id,
+                    'track': track.id,
+                    'message': f"Could not mark {track.name or student_id}, retrying.",
+                })
+                continue
+            track.name, track.marked = name, student_id
+            metrics.inc('kiosk', 'recognized' if created else 'already_marked')
+            await send_json({
+                'type': 'marked',
+                'student_id': student_id,
+                'name': name,
+                'created': created,
+                'track': track.id,
+                'message': (f"{name}'s attendance marked successfully!" if created
+                            else f"{name}'s attendance already marked today."),
+            })
+        await send_json({
+            'type': 'faces',
+            'frame': session.frames,
+            'recognitions': session.recognitions,
+            'faces': session.describe(frame),
+        })
+
+
+def with_kiosk_websocket(django_application, path=KIOSK_WS_PATH):
+    """ASGI application serving the kiosk WebSocket at path and everything else with Django"""
+    async def application(scope, receive, send):
+        if scope['type'] == 'websocket':
+            if scope['path'] == path or scope['path'] == path.rstrip('/'):
+                return await kiosk_websocket(scope, receive, send)
+            # Closing before accepting rejects the handshake
+            await send({'type': 'websocket.close'})
+            return
+        return await django_application(scope, receive, send)
+    return application
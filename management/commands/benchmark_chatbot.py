@@ -0,0 +1,70 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...dashboard_cache import get_students
+from ...query_engine import answer_question
+
+# Questions an administrator typically asks; {name} is filled with an enrolled student
+DEFAULT_CORPUS = [
+    'How many students attended today?',
+    'total present',
+    'how many absent this month',
+    'total late last week',
+    'Who was late today?',
+    'who was absent yesterday',
+    'Which students were late on 2024-01-05?',
+    'who was present between 2024-01-01 and 2024-01-31',
+    'Who has the most absences?',
+    'who was late the most this month',
+    'Show me attendance for {name}',
+    'How many times was {name} late?',
+    'how many days was {name} absent in January',
+    "What's the attendance percentage this month?",
+    'attendance percentage for {name}',
+    'what percent of records are late',
+    'What is the longest streak for {name}?',
+    '{name} streak this year',
+    'How do I export attendance data?',
+    'Summarize attendance trends for the principal',
+    'Is attendance improving compared to last term?',
+    'Write a note to parents of frequently absent students',
+]
+
+
+class Command(BaseCommand):
+    help = 'Report how many chatbot questions the local query engine answers without the LLM'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='Question corpus, one question per line (defaults to a built-in set)')
+        parser.add_argument('--repeat', type=int, default=5, help='Times to answer each question for timing')
+        parser.add_argument('--verbose-answers', action='store_true', help='Print every question with its answer')
+
+    def handle(self, *args, **options):
+        if options['file']:
+            with open(options['file'], encoding='utf-8') as corpus_file:
+                corpus = [line.strip() for line in corpus_file if line.strip()]
+        else:
+            students = get_students()
+            name = students[0].name if students else 'Unknown Student'
+            corpus = [question.format(name=name) for question in DEFAULT_CORPUS]
+
+        hits = 0
+        timings = []
+        for question in corpus:
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                answer = answer_question(question.lower())
+                timings.append((time.perf_counter() - started) * 1000)
+            if answer:
+                hits += 1
+            if options['verbose_answers']:
+                self.stdout.write(f"{question}\n    -> {answer or '(LLM)'}")
+
+        timings.sort()
+        self.stdout.write(f"Questions:       {len(corpus)}")
+        self.stdout.write(f"Answered locally: {hits} ({hits / len(corpus):.0%})")
+        self.stdout.write(f"Sent to LLM:     {len(corpus) - hits}")
+        self.stdout.write(f"Local latency:   p50 {statistics.median(timings):.2f} ms, "
+                          f"p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms")
@@ -0,0 +1,273 @@
+import datetime
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from ...models import Student, Attendance
+from ... import assistant, encoders, engine, frame_cache, gallery, metrics, sheets
+from ...marking import get_marked_today
+from ...dashboard_cache import invalidate_attendance_dates, invalidate_students
+
+FACE_SIZE = 96
+
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(',') if size.strip()]
+
+
+def percentiles(values):
+    """(p50, p95, p99) of a list of numbers"""
+    values = sorted(values)
+    return tuple(values[min(len(values) - 1, int(len(values) * q))] for q in (0.5, 0.95, 0.99))
+
+
+def synthetic_face(rng):
+    """A smooth random texture standing in for one student's face"""
+    noise = rng.integers(0, 256, (FACE_SIZE // 4, FACE_SIZE // 4), dtype=np.uint8)
+    return cv2.resize(noise, (FACE_SIZE, FACE_SIZE), interpolation=cv2.INTER_CUBIC)
+
+
+def synthetic_frame(face, box, frame_size, rng, noise=8):
+    """JPEG-encoded BGR frame with face pasted at box plus sensor noise"""
+    width, height = frame_size
+    frame = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    x, y, w, h = box
+    frame[y:y + h, x:x + w] = cv2.resize(face, (w, h))
+    frame = np.clip(frame.astype(np.int16) + rng.normal(0, noise, frame.shape), 0, 255).astype(np.uint8)
+    ok, encoded = cv2.imencode('.jpg', cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return encoded.tobytes()
+
+
+def random_templates(count, rng):
+    matrix = rng.standard_normal((count, FACE_SIZE * FACE_SIZE)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+class Command(BaseCommand):
+    help = ('Benchmark upload_image end to end on a throwaway database with a synthetic gallery and frames, '
+            'then face matching versus gallery size and export_excel versus row count. '
+            'Runs offline: Google Sheets and OpenAI are replaced with local stand-ins, and the synthetic '
+            'faces are matched with the pixel encoder, so the numbers measure the pipeline, not accuracy.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=500, help='Students enrolled in the synthetic gallery')
+        parser.add_argument('--frames', type=int, default=400, help='Probe frames posted to upload_image')
+        parser.add_argument('--concurrency', default='1,4', help='Comma-separated client thread counts')
+        parser.add_argument('--workers', type=int, help='Recognition workers (default: RECOGNITION_WORKERS)')
+        parser.add_argument('--frame-size', default='640x480', help='Probe frame size, WIDTHxHEIGHT')
+        parser.add_argument('--unknown-ratio', type=float, default=0.1,
+                            help='Share of probe frames showing someone not enrolled')
+        parser.add_argument('--detector', choices=['synthetic', 'haar'], default='synthetic',
+                            help='synthetic reports the pasted face box so every stage runs; '
+                                 'haar runs the real cascade (synthetic faces will not be found)')
+        parser.add_argument('--gallery-sizes', default='1000,5000,20000',
+                            help='Gallery sizes for the matching micro-benchmark')
+        parser.add_argument('--export-rows', default='1000,10000,50000',
+                            help='Attendance row counts for the export micro-benchmark')
+        parser.add_argument('--skip', action='append', default=[], choices=['upload', 'match', 'export'],
+                            help='Skip a section; may be repeated')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            width, height = (int(v) for v in options['frame_size'].lower().split('x'))
+        except ValueError:
+            raise CommandError('--frame-size must look like 640x480')
+        self.rng = np.random.default_rng(options['seed'])
+        self.frame_size = (width, height)
+        side = min(width, height) // 2
+        self.box = ((width - side) // 2, (height - side) // 2, side, side)
+
+        workdir = tempfile.mkdtemp(prefix='faceapp-bench-')
+        # Synthetic textures aren't faces to face_recognition
+        pixel_encoder = override_settings(FACE_ENCODER=encoders.PixelEncoder.name)
+        pixel_encoder.enable()
+        patches = [
+            mock.patch.object(sheets, '_writer', sheets.SheetWriter(
+                sheets.SheetOutbox(os.path.join(workdir, 'outbox.sqlite3')), sheets.LocalSheetBackend())),
+            mock.patch.object(assistant, '_client', assistant.LocalChatClient()),
+            mock.patch.object(gallery, '_gallery', gallery.FaceGallery()),
+            # Every client posts from one address, so cached repeats would stand in for recognition
+            mock.patch.object(frame_cache, '_cache', frame_cache.RecentFrames(size=0)),
+            mock.patch.object(engine, '_engine', engine.RecognitionEngine(
+                workers=options['workers'] or getattr(settings, 'RECOGNITION_WORKERS', None),
+                queue_size=max(parse_sizes(options['concurrency']) or [1]) * 2)),
+        ]
+        if options['detector'] == 'synthetic':
+            patches.append(mock.patch.object(encoders, 'detect_faces', self.synthetic_detector))
+        if connection.vendor == 'sqlite':
+            # A file database, like production, rather than a shared in-memory one
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for patch in patches:
+                patch.start()
+            get_marked_today().clear()
+            if 'upload' not in options['skip']:
+                self.bench_upload(options)
+            if 'match' not in options['skip']:
+                self.bench_match(parse_sizes(options['gallery_sizes']))
+            if 'export' not in options['skip']:
+                self.bench_export(parse_sizes(options['export_rows']))
+        finally:
+            for patch in reversed(patches):
+                patch.stop()
+            get_marked_today().clear()
+            invalidate_students()
+            invalidate_attendance_dates()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            pixel_encoder.disable()
+
+    def synthetic_detector(self, image):
+        """The pasted face box, scaled to the size the frame was decoded at"""
+        scale = image.shape[1] / self.frame_size[0]
+        return [tuple(int(v * scale) for v in self.box)]
+
+    def enrol(self, count):
+        """Create count students and a matching gallery; returns their synthetic faces"""
+        faces = [synthetic_face(self.rng) for _ in range(count)]
+        Student.objects.bulk_create(
+            [Student(name=f'Student {i}', student_id=f'S{i:06d}') for i in range(count)], batch_size=500)
+        full = (0, 0, FACE_SIZE, FACE_SIZE)
+        gallery.get_gallery().replace({
+            f'S{i:06d}': gallery.face_template(face, full) for i, face in enumerate(faces)
+        })
+        invalidate_students()
+        return faces
+
+    def bench_upload(self, options):
+        faces = self.enrol(options['students'])
+        frames = []
+        for _ in range(options['frames']):
+            if self.rng.random() < options['unknown_ratio']:
+                face = synthetic_face(self.rng)
+            else:
+                face = faces[self.rng.integers(len(faces))]
+            frames.append(synthetic_frame(face, self.box, self.frame_size, self.rng))
+        url = reverse('upload_image')
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"upload_image: {len(frames)} frames of {self.frame_size[0]}x{self.frame_size[1]}, "
+            f"{options['students']} students, {engine.get_engine().workers} recognition worker(s)"))
+        for concurrency in parse_sizes(options['concurrency']):
+            Attendance.objects.all().delete()
+            get_marked_today().clear()
+            latencies = []
+            outcomes = {}
+            lock = threading.Lock()
+            cursor = iter(range(len(frames)))
+
+            def client_loop():
+                client = Client()
+                try:
+                    while True:
+                        with lock:
+                            index = next(cursor, None)
+                        if index is None:
+                            return
+                        started = time.perf_counter()
+                        response = client.post(url, data=frames[index], content_type='image/jpeg')
+                        elapsed = time.perf_counter() - started
+                        outcome = 'busy' if response.status_code == 503 else (
+                            'marked' if response.json().get('success') else 'not marked')
+                        with lock:
+                            latencies.append(elapsed)
+                            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                finally:
+                    connection.close()
+
+            with metrics.capture() as samples:
+                started = time.perf_counter()
+                threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                wall = time.perf_counter() - started
+
+            p50, p95, p99 = percentiles(latencies)
+            self.stdout.write(
+                f"  concurrency {concurrency}: {len(latencies) / wall:.1f} frames/s, "
+                f"latency p50 {p50 * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms; "
+                + ', '.join(f"{n} {outcome}" for outcome, n in sorted(outcomes.items()))
+            )
+            self.stdout.write(f"    {'stage':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'frames/s':>11}")
+            for (view, stage), values in sorted(samples.items()):
+                if view not in ('upload_image', 'recognition'):
+                    continue
+                p50, p95, p99 = percentiles(values)
+                mean = sum(values) / len(values)
+                self.stdout.write(
+                    f"    {view + '.' + stage:<28}{len(values):>7}{p50 * 1000:>10.2f}{p95 * 1000:>10.2f}"
+                    f"{p99 * 1000:>10.2f}{(1 / mean if mean else 0):>11.0f}")
+
+    def bench_match(self, sizes):
+        self.stdout.write(self.style.MIGRATE_HEADING('Gallery search versus gallery size (200 probes each)'))
+        ann_min_size = getattr(settings, 'FACE_GALLERY_ANN_MIN_SIZE', 2000)
+        for size in sizes:
+            matrix = random_templates(size, self.rng)
+            faces = gallery.FaceGallery()
+            faces.replace({f'S{i}': row for i, row in enumerate(matrix)})
+            rows = self.rng.integers(size, size=200)
+            probes = matrix[rows] + 0.02 * random_templates(len(rows), self.rng)
+            probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+            for mode in ('exact', 'ann'):
+                if mode == 'ann' and size < ann_min_size:
+                    continue
+                exact = mode == 'exact'
+                faces.search(probes[0], exact=exact)  # builds the partitioned index
+                timings = []
+                hits = 0
+                for row, probe in zip(rows, probes):
+                    started = time.perf_counter()
+                    best = faces.search(probe, exact=exact)
+                    timings.append(time.perf_counter() - started)
+                    hits += best[0][0] == f'S{row}'
+                p50, p95, p99 = percentiles(timings)
+                self.stdout.write(
+                    f"  {size:>8} templates, {mode:<5}: p50 {p50 * 1000:.3f} ms, p95 {p95 * 1000:.3f} ms, "
+                    f"p99 {p99 * 1000:.3f} ms, {len(timings) / sum(timings):.0f} searches/s, recall@1 {hits / len(rows):.0%}")
+
+    def bench_export(self, sizes):
+        self.stdout.write(self.style.MIGRATE_HEADING('export_excel versus row count'))
+        Attendance.objects.all().delete()
+        students = list(Student.objects.order_by('id')[:500])
+        if not students:
+            self.enrol(100)
+            students = list(Student.objects.order_by('id'))
+        first_day = datetime.date(2024, 1, 1)
+        client = Client()
+        url = reverse('export')
+        created = 0
+        for size in sorted(sizes):
+            # Row n is student n % S on day n // S, so (student, date) stays unique
+            Attendance.objects.bulk_create([
+                Attendance(student=students[n % len(students)],
+                           date=first_day + datetime.timedelta(days=n // len(students)),
+                           status='late' if n % 7 == 0 else 'present')
+                for n in range(created, size)
+            ], batch_size=1000)
+            created = max(created, size)
+            for export_format in ('xlsx', 'csv'):
+                started = time.perf_counter()
+                response = client.get(url, {'format': export_format})
+                body = b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"  {size:>8} rows, {export_format:<4}: {elapsed * 1000:.0f} ms, "
+                    f"{size / elapsed:.0f} rows/s, {len(body) / 1024:.0f} KiB")
@@ -0,0 +1,140 @@
+import datetime
+import os
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from ...models import Student, Attendance
+from ... import rollups
+from ...exports import attendance_rows
+from ...marking import get_marked_today, mark_student_present
+from ...dashboard_cache import invalidate_attendance_dates, invalidate_students
+from .benchmark_pipeline import percentiles
+
+PROFILES = {
+    'baseline': {'SQLITE_PROFILE': False, 'ATTENDANCE_WRITE_COALESCING': False},
+    'wal': {'SQLITE_PROFILE': True, 'ATTENDANCE_WRITE_COALESCING': False},
+    'wal+coalesce': {'SQLITE_PROFILE': True, 'ATTENDANCE_WRITE_COALESCING': True},
+}
+
+
+class Command(BaseCommand):
+    help = ('Compare attendance write throughput on a throwaway SQLite file with concurrent dashboard/export '
+            'readers: default journal, the WAL profile, and WAL with the write coalescer')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kiosks', type=int, default=8, help='Threads marking attendance')
+        parser.add_argument('--marks', type=int, default=50, help='Students marked by each kiosk thread')
+        parser.add_argument('--readers', type=int, default=2, help='Threads running dashboard and export queries')
+        parser.add_argument('--history-days', type=int, default=30, help='Days of past attendance for the readers')
+        parser.add_argument('--profile', action='append', choices=list(PROFILES),
+                            help='Profile to run; may be repeated (default: all)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('benchmark_sqlite needs the SQLite backend')
+        workdir = tempfile.mkdtemp(prefix='faceapp-sqlite-bench-')
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.populate(options)
+            self.stdout.write(
+                f"{options['kiosks']} kiosk thread(s) x {options['marks']} marks, "
+                f"{options['readers']} reader thread(s), {Attendance.objects.count()} rows of history")
+            for name in options['profile'] or list(PROFILES):
+                with override_settings(**PROFILES[name]):
+                    self.run_profile(name, options)
+        finally:
+            connection.close()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            get_marked_today().clear()
+            invalidate_students()
+            invalidate_attendance_dates()
+
+    def populate(self, options):
+        count = options['kiosks'] * options['marks']
+        Student.objects.bulk_create(
+            [Student(name=f'Student {i}', student_id=f'S{i:06d}') for i in range(count)], batch_size=500)
+        students = list(Student.objects.all())
+        today = timezone.now().date()
+        Attendance.objects.bulk_create([
+            Attendance(student=student, date=today - datetime.timedelta(days=day), status='present')
+            for day in range(1, options['history_days'] + 1) for student in students
+        ], batch_size=1000)
+        rollups.rebuild()
+
+    def run_profile(self, name, options):
+        # Fresh connections so connection_created applies this profile's PRAGMAs
+        connection.close()
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            if name == 'baseline':
+                cursor.execute('PRAGMA journal_mode = DELETE')
+            mode = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+        today = timezone.now().date()
+        Attendance.objects.filter(date=today).delete()
+        rollups.rebuild()
+        get_marked_today().clear()
+
+        student_ids = list(Student.objects.order_by('id').values_list('student_id', flat=True))
+        latencies, errors, reads = [], [], [0]
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def kiosk(ids):
+            try:
+                for student_id in ids:
+                    started = time.perf_counter()
+                    try:
+                        mark_student_present(student_id, today)
+                    except Exception as e:
+                        with lock:
+                            errors.append(str(e))
+                        continue
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        def reader():
+            try:
+                while not done.is_set():
+                    list(Attendance.objects.select_related('student').order_by('-date', '-time_in', '-id')[:50])
+                    rollups.total(date=today)
+                    for _ in attendance_rows(Attendance.objects.all()):
+                        pass
+                    with lock:
+                        reads[0] += 1
+            finally:
+                connection.close()
+
+        marks = options['marks']
+        writers = [threading.Thread(target=kiosk, args=(student_ids[i * marks:(i + 1) * marks],))
+                   for i in range(options['kiosks'])]
+        readers = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        started = time.perf_counter()
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        wall = time.perf_counter() - started
+        done.set()
+        for thread in readers:
+            thread.join()
+
+        marked = Attendance.objects.filter(date=today).count()
+        line = f"  {name:<13} journal={mode:<7} {len(latencies) / wall:8.1f} marks/s"
+        if latencies:
+            p50, p95, p99 = percentiles(latencies)
+            line += f", p50 {p50 * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms"
+        line += f", {reads[0]} reader passes, {marked} rows marked, {len(errors)} error(s)"
+        self.stdout.write(line)
+        for message in sorted(set(errors))[:3]:
+            self.stdout.write(self.style.WARNING(f"    {message}"))
@@ -0,0 +1,81 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+APP_PACKAGE = __name__.split('.management.')[0]
+
+# Runs in a fresh interpreter so nothing is imported or loaded yet
+PROBE = '''
+import importlib, json, sys, time
+app, mode, frame_path = sys.argv[1:4]
+started = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter() - started
+started = time.perf_counter()
+views = importlib.import_module(app + '.views')
+views_import = time.perf_counter() - started
+warm_up = 0.0
+if mode == 'warm':
+    started = time.perf_counter()
+    importlib.import_module(app + '.warmup').warm_up()
+    warm_up = time.perf_counter() - started
+from django.test import RequestFactory
+with open(frame_path, 'rb') as f:
+    frame = f.read()
+requests = []
+for _ in range(3):
+    request = RequestFactory().post('/upload_image/', data=frame, content_type='image/jpeg')
+    started = time.perf_counter()
+    views.upload_image(request)
+    requests.append(time.perf_counter() - started)
+print(json.dumps({'setup': setup, 'views_import': views_import, 'warm_up': warm_up, 'requests': requests}))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Measure Django setup and views import time, warm-up time and first-request latency '
+            'of upload_image with and without warm-up, each in fresh processes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3, help='Fresh processes per mode')
+
+    def probe(self, mode, frame_path):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+        result = subprocess.run(
+            [sys.executable, '-c', PROBE, APP_PACKAGE, mode, frame_path],
+            capture_output=True, text=True, env=env
+        )
+        if result.returncode:
+            raise CommandError(f"Probe process failed:\n{result.stderr}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        import cv2
+        import numpy as np
+
+        # A blank frame: no face, so nothing is written to the database
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as frame_file:
+            frame_file.write(cv2.imencode('.jpg', np.full((480, 640, 3), 128, np.uint8))[1].tobytes())
+        try:
+            results = {mode: [self.probe(mode, frame_file.name) for _ in range(options['runs'])]
+                       for mode in ('cold', 'warm')}
+        finally:
+            os.remove(frame_file.name)
+
+        def median_ms(mode, key, index=None):
+            values = [run[key] if index is None else run[key][index] for run in results[mode]]
+            return statistics.median(values) * 1000
+
+        self.stdout.write(f"Median of {options['runs']} fresh process(es) per mode:")
+        self.stdout.write(f"  Django setup:                {median_ms('cold', 'setup'):8.1f} ms")
+        self.stdout.write(f"  views import:                {median_ms('cold', 'views_import'):8.1f} ms")
+        self.stdout.write(f"  First request, cold:         {median_ms('cold', 'requests', 0):8.1f} ms")
+        self.stdout.write(f"  Warm-up (app ready):         {median_ms('warm', 'warm_up'):8.1f} ms")
+        self.stdout.write(f"  First request, warmed up:    {median_ms('warm', 'requests', 0):8.1f} ms")
+        self.stdout.write(f"  Steady state (3rd request):  {median_ms('warm', 'requests', 2):8.1f} ms")
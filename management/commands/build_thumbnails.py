@@ -0,0 +1,37 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from ...models import Student
+from ...thumbnails import make_thumbnail
+
+
+class Command(BaseCommand):
+    help = 'Create the dashboard thumbnails of student photos that have none yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Recreate thumbnails that already exist')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Threads resizing photos (default: one per CPU)')
+
+    def handle(self, *args, **options):
+        students = list(Student.objects.exclude(photo='').exclude(photo__isnull=True))
+
+        def build(student):
+            try:
+                make_thumbnail(student, force=options['force'])
+                return None
+            except Exception as e:
+                return f"{student.student_id}: {e}"
+
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'] or 1)) as pool:
+            failures = [failure for failure in pool.map(build, students) if failure]
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Thumbnails ready for {len(students) - len(failures)} of {len(students)} student photo(s)."
+        ))
+        if failures:
+            self.stdout.write(self.style.WARNING(f"Failed for {len(failures)} photo(s):"))
+            for failure in failures:
+                self.stdout.write(f"  {failure}")
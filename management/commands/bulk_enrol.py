@@ -0,0 +1,148 @@
+import csv
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Student
+from ...dashboard_cache import invalidate_students
+from ...encoders import get_encoder
+from ...gallery import (IMAGE_EXTENSIONS, FaceGallery, enrolment_template,
+                        get_known_faces_dir, get_snapshot_dir)
+from ...gallery_store import SnapshotStore
+from ...thumbnails import make_thumbnail
+
+
+class Command(BaseCommand):
+    help = ('Enrol students in bulk from a directory of <student_id>.jpg photos or a CSV with '
+            'student_id, name, email and photo columns, computing face templates in parallel')
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory of photos or CSV file')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Processes used for face detection (default: one per CPU)')
+        parser.add_argument('--update', action='store_true',
+                            help='Replace the photo and template of students that are already enrolled')
+
+    def read_entries(self, source):
+        """[(student_id, name, email, photo_path)] from a directory or CSV"""
+        if os.path.isdir(source):
+            # Directory photos carry no name, so students are named after their ID
+            return [
+                (os.path.splitext(filename)[0], os.path.splitext(filename)[0], '', os.path.join(source, filename))
+                for filename in sorted(os.listdir(source))
+                if filename.lower().endswith(IMAGE_EXTENSIONS)
+            ]
+        if not source.lower().endswith('.csv') or not os.path.isfile(source):
+            raise CommandError(f"{source} is neither a directory nor a CSV file")
+        base_dir = os.path.dirname(os.path.abspath(source))
+        entries = []
+        with open(source, newline='', encoding='utf-8-sig') as f:
+            reader = csv.DictReader(f)
+            missing = {'student_id', 'photo'} - set(reader.fieldnames or [])
+            if missing:
+                raise CommandError(f"CSV is missing column(s): {', '.join(sorted(missing))}")
+            for row in reader:
+                student_id = (row.get('student_id') or '').strip()
+                if not student_id:
+                    continue
+                photo = os.path.join(base_dir, (row.get('photo') or '').strip())
+                entries.append((student_id, (row.get('name') or '').strip() or student_id,
+                                (row.get('email') or '').strip(), photo))
+        return entries
+
+    def handle(self, *args, **options):
+        entries = self.read_entries(options['source'])
+        rejected = []
+        seen = set()
+        unique = []
+        for entry in entries:
+            if entry[0] in seen:
+                rejected.append((entry[3], f"duplicate student ID {entry[0]}"))
+            else:
+                seen.add(entry[0])
+                unique.append(entry)
+
+        enrolled = set(Student.objects.values_list('student_id', flat=True))
+        skipped = 0
+        if not options['update']:
+            skipped = sum(1 for entry in unique if entry[0] in enrolled)
+            unique = [entry for entry in unique if entry[0] not in enrolled]
+
+        workers = max(1, options['workers'] or 1)
+        paths = [entry[3] for entry in unique]
+        # Passed to the workers so they don't need Django settings
+        encoder = get_encoder()
+        if paths:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(partial(enrolment_template, encoder=encoder), paths,
+                                        chunksize=max(1, len(paths) // (workers * 4))))
+        else:
+            results = []
+
+        known_faces_dir = get_known_faces_dir()
+        os.makedirs(known_faces_dir, exist_ok=True)
+        existing = Student.objects.in_bulk([entry[0] for entry in unique if entry[0] in enrolled],
+                                           field_name='student_id')
+        templates = {}
+        new_students = []
+        updated_students = []
+        accepted = 0
+        for (student_id, name, email, path), (template, face_count) in zip(unique, results):
+            if face_count is None:
+                rejected.append((path, 'could not read image'))
+                continue
+            if face_count == 0:
+                rejected.append((path, 'no face found'))
+                continue
+            if face_count > 1:
+                rejected.append((path, f"{face_count} faces found"))
+                continue
+
+            ext = os.path.splitext(path)[1].lower()
+            for other in IMAGE_EXTENSIONS:
+                if other != ext and os.path.exists(os.path.join(known_faces_dir, student_id + other)):
+                    os.remove(os.path.join(known_faces_dir, student_id + other))
+            shutil.copyfile(path, os.path.join(known_faces_dir, student_id + ext))
+            templates[student_id] = template
+            accepted += 1
+
+            if student_id not in enrolled:
+                student = Student(name=name, student_id=student_id, email=email)
+                with open(path, 'rb') as f:
+                    student.photo.save(os.path.basename(path), File(f), save=False)
+                new_students.append(student)
+            elif student_id in existing:
+                # The dashboard shows Student.photo, so it follows the new template
+                student = existing[student_id]
+                old_photo = student.photo.name
+                with open(path, 'rb') as f:
+                    student.photo.save(os.path.basename(path), File(f), save=False)
+                updated_students.append((student, old_photo))
+
+        # One snapshot for the whole batch; running servers reload it
+        FaceGallery(store=SnapshotStore(get_snapshot_dir()), encoder=encoder).add_templates(templates)
+        Student.objects.bulk_create(new_students, batch_size=500, ignore_conflicts=True)
+        if updated_students:
+            Student.objects.bulk_update([student for student, _ in updated_students], ['photo'], batch_size=500)
+            for student, old_photo in updated_students:
+                if old_photo and old_photo != student.photo.name:
+                    student.photo.storage.delete(old_photo)
+                try:
+                    make_thumbnail(student, force=True)
+                except Exception as e:
+                    self.stdout.write(self.style.WARNING(f"  Error creating thumbnail for {student.student_id}: {e}"))
+        if new_students or updated_students:
+            invalidate_students()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Enrolled {accepted} photo(s): {len(new_students)} new student(s), "
+            f"{accepted - len(new_students)} updated; {skipped} already enrolled and skipped."
+        ))
+        if rejected:
+            self.stdout.write(self.style.WARNING(f"Rejected {len(rejected)} photo(s):"))
+            for path, reason in rejected:
+                self.stdout.write(f"  {path}: {reason}")
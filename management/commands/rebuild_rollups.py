@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ... import rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily and monthly attendance summary tables from the Attendance table'
+
+    def handle(self, *args, **options):
+        rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {rollups.DailyStatusCount.objects.count()} daily and "
+            f"{rollups.MonthlyStudentCount.objects.count()} monthly counters."
+        ))
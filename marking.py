@@ -0,0 +1,335 @@
+"""Attendance marking with a per-day cache of students already marked"""
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+
+from .models import Student, Attendance
+from . import rollups
+from .assistant import bump_data_version
+from .dashboard_cache import invalidate_attendance_dates, invalidate_students
+
+_marked_today = None
+_marked_today_lock = threading.Lock()
+_coalescer = None
+_coalescer_lock = threading.Lock()
+
+
+class MarkedTodayCache:
+    """student_id -> name for everyone marked on the current day.
+
+    Filled from the database the first time a day is seen, so repeat scans
+    answer without a query. A miss falls through to the database, but a hit
+    is trusted: a row deleted in this process is discarded by the attendance
+    receiver, while one deleted in another worker still reads as marked until
+    the day is reloaded, at most ttl seconds later.
+    """
+
+    def __init__(self, ttl=60.0):
+        self.ttl = ttl
+        self._day = None
+        self._loaded_at = 0.0
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def _roll(self, today):
+        # Caller holds the lock
+        now = time.monotonic()
+        if self._day != today or now - self._loaded_at > self.ttl:
+            self._names = dict(
+                Attendance.objects.filter(date=today)
+                .values_list('student__student_id', 'student__name')
+            )
+            self._day = today
+            self._loaded_at = now
+
+    def get(self, student_id, today):
+        """Name of the student if already marked on today, else None"""
+        with self._lock:
+            self._roll(today)
+            return self._names.get(student_id)
+
+    def add(self, student_id, name, today):
+        with self._lock:
+            self._roll(today)
+            self._names[student_id] = name
+
+    def discard(self, student_id, day=None):
+        """Forget a student, e.g. after their attendance row was deleted"""
+        with self._lock:
+            if day is None or day == self._day:
+                self._names.pop(student_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._day = None
+            self._names = {}
+
+
+def get_marked_today():
+    """Process-wide cache of students marked today"""
+    global _marked_today
+    if _marked_today is None:
+        with _marked_today_lock:
+            if _marked_today is None:
+                _marked_today = MarkedTodayCache(ttl=getattr(settings, 'MARKED_TODAY_TTL', 60.0))
+    return _marked_today
+
+
+class WriteCoalescer:
+    """Funnels attendance inserts from many request threads through one writer thread.
+
+    Requests arriving within window seconds of each other are marked with a
+    single mark_students_present() call in one transaction, so SQLite takes
+    the write lock and commits once per batch instead of once per student.
+    """
+
+    def __init__(self, window=0.01, max_batch=100):
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.marked = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._has_work = threading.Event()
+        self._full = threading.Event()
+        self._thread = None
+
+    def mark(self, student_id, today, timeout=30):
+        """Queue one student and wait for the batch; returns (student_name, created)"""
+        future = Future()
+        with self._lock:
+            self._pending.append((student_id, today, future))
+            if len(self._pending) >= self.max_batch:
+                self._full.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='attendance-writer', daemon=True)
+                self._thread.start()
+        self._has_work.set()
+        return future.result(timeout)
+
+    def _run(self):
+        while True:
+            self._has_work.wait()
+            # Give other requests a moment to join the batch
+            self._full.wait(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._has_work.clear()
+                self._full.clear()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        close_old_connections()
+        by_day = {}
+        for student_id, today, future in batch:
+            by_day.setdefault(today, []).append((student_id, future))
+        for today, requests in by_day.items():
+            try:
+                with transaction.atomic():
+                    names, newly_marked = mark_students_present({sid for sid, _ in requests}, today)
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.marked += len(newly_marked)
+            for student_id, future in requests:
+                # Only the first request for a student in the batch reports it as new
+                created = student_id in newly_marked
+                newly_marked.discard(student_id)
+                future.set_result((names[student_id], created))
+
+    def stats(self):
+        return {'batches': self.batches, 'marked': self.marked, 'pending': len(self._pending)}
+
+
+def get_write_coalescer():
+    """Process-wide coalescer, or None unless ATTENDANCE_WRITE_COALESCING is on"""
+    global _coalescer
+    if not getattr(settings, 'ATTENDANCE_WRITE_COALESCING', False):
+        return None
+    if _coalescer is None:
+        with _coalescer_lock:
+            if _coalescer is None:
+                _coalescer = WriteCoalescer(
+                    window=getattr(settings, 'ATTENDANCE_COALESCE_WINDOW', 0.01),
+                    max_batch=getattr(settings, 'ATTENDANCE_COALESCE_MAX_BATCH', 100),
+                )
+    return _coalescer
+
+
+def mark_student_present(student_id, today):
+    """Mark one student present, at most once per day.
+
+    Returns (student_name, created). Relies on the unique (student, date)
+    constraint, so two kiosks recognizing the same face never both insert.
+    With ATTENDANCE_WRITE_COALESCING the insert is batched with other
+    requests' by the WriteCoalescer.
+    """
+    cache = get_marked_today()
+    name = cache.get(student_id, today)
+    if name is not None:
+        return name, False
+
+    coalescer = get_write_coalescer()
+    if coalescer is not None:
+        return coalescer.mark(student_id, today)
+
+    # Unknown IDs get a placeholder student named after the ID
+    student, student_created = Student.objects.get_or_create(student_id=student_id, defaults={'name': student_id})
+    if student_created:
+        invalidate_students()
+    # Insert first, so the transaction takes the write lock up front and the
+    # rollup receivers run inside it; the unique constraint rejects repeats
+    try:
+        with transaction.atomic():
+            Attendance.objects.create(student=student, date=today, status='present')
+        created = True
+    except IntegrityError:
+        created = False
+    cache.add(student_id, student.name, today)
+    return student.name, created
+
+
+def attendance_changed(sender, instance, created=None, raw=False, **kwargs):
+    """post_save and post_delete receiver for Attendance, admin edits included.
+
+    Drops the dashboard's date list and the chatbot's cached context and
+    answers, and forgets the student in this process's marked-today cache
+    when a row is deleted or edited. bulk_create and bulk_update send no
+    signals, so the bulk paths below invalidate themselves.
+    """
+    if raw or rollups.is_suspended():
+        return
+    invalidate_attendance_dates()
+    bump_data_version()
+    if created is None:
+        # post_delete
+        get_marked_today().discard(instance.student.student_id, instance.date)
+    elif not created:
+        # An edit may have moved the row off today, so forget the student for any day
+        get_marked_today().discard(instance.student.student_id)
+
+
+def insert_new_rows(rows):
+    """bulk_create Attendance rows, skipping conflicts; returns {(student pk, date): row id} of those inserted here.
+
+    ignore_conflicts sets no primary keys, so a stored row counts as ours
+    when it carries the created_at that bulk_create stamped on our instance;
+    a row another process inserted in the meantime keeps its own.
+    """
+    if not rows:
+        return {}
+    Attendance.objects.bulk_create(rows, ignore_conflicts=True)
+    stamps = {(row.student_id, row.date): row.created_at for row in rows}
+    stored = Attendance.objects.filter(
+        student_id__in={pk for pk, _ in stamps}, date__in={day for _, day in stamps}
+    ).values_list('id', 'student_id', 'date', 'created_at')
+    return {(pk, day): row_id for row_id, pk, day, created_at in stored if stamps.get((pk, day)) == created_at}
+
+
+def mark_students_present(student_ids, today):
+    """Mark every student in student_ids present with one bulk insert.
+
+    Returns (names, newly_marked) where names maps student_id to name and
+    newly_marked is the set of student_ids that got a new row.
+    """
+    cache = get_marked_today()
+    names = {}
+    pending = []
+    for student_id in student_ids:
+        name = cache.get(student_id, today)
+        if name is None:
+            pending.append(student_id)
+        else:
+            names[student_id] = name
+    if not pending:
+        return names, set()
+
+    students = Student.objects.in_bulk(pending, field_name='student_id')
+    missing = [sid for sid in pending if sid not in students]
+    if missing:
+        Student.objects.bulk_create(
+            [Student(name=sid, student_id=sid) for sid in missing],
+            ignore_conflicts=True
+        )
+        students = Student.objects.in_bulk(pending, field_name='student_id')
+        invalidate_students()
+
+    already_marked = set(Attendance.objects.filter(
+        date=today,
+        student__in=students.values()
+    ).values_list('student__student_id', flat=True))
+    inserted = insert_new_rows([
+        Attendance(student=student, date=today, status='present')
+        for sid, student in students.items() if sid not in already_marked
+    ])
+    newly_marked = {sid for sid, student in students.items() if (student.pk, today) in inserted}
+    if newly_marked:
+        rollups.apply_changes([(students[sid].pk, today, 'present') for sid in newly_marked])
+        invalidate_attendance_dates()
+        bump_data_version()
+    for sid, student in students.items():
+        names[sid] = student.name
+        cache.add(sid, student.name, today)
+    return names, newly_marked
+
+
+def record_attendance_events(events, today):
+    """Apply recognized (student_id, date, time_in) events in bulk, e.g. synced from a kiosk queue.
+
+    Returns (outcomes, names): one of 'marked', 'already_marked', 'duplicate'
+    (an earlier event in the batch marked the same student and day) or
+    'unknown_student' per event, and student_id -> name. Events may be for
+    past days; each student is marked at most once per day, at the time of
+    the earliest event.
+    """
+    students = Student.objects.in_bulk({sid for sid, _, _ in events}, field_name='student_id')
+    days = {day for sid, day, _ in events if sid in students}
+    existing = set()
+    if days:
+        existing = set(Attendance.objects.filter(
+            student__in=students.values(), date__in=days
+        ).values_list('student_id', 'date'))
+
+    earliest = {}
+    for index, (sid, day, time_in) in enumerate(events):
+        student = students.get(sid)
+        if student is None or (student.pk, day) in existing:
+            continue
+        key = (student.pk, day)
+        if key not in earliest or time_in < events[earliest[key]][2]:
+            earliest[key] = index
+
+    inserted = insert_new_rows([Attendance(student_id=pk, date=day, status='present') for pk, day in earliest])
+    if inserted:
+        # time_in is set on insert, so give the new rows the time of the scan
+        Attendance.objects.bulk_update([
+            Attendance(id=row_id, time_in=events[earliest[key]][2]) for key, row_id in inserted.items()
+        ], ['time_in'])
+        rollups.apply_changes([(pk, day, 'present') for pk, day in inserted])
+        invalidate_attendance_dates()
+        bump_data_version()
+
+    outcomes = []
+    first = {index: key for key, index in earliest.items()}
+    for index, (sid, day, _) in enumerate(events):
+        if sid not in students:
+            outcomes.append('unknown_student')
+        elif index in first:
+            # Another process may have marked the pair since it was checked
+            outcomes.append('marked' if first[index] in inserted else 'already_marked')
+        elif (students[sid].pk, day) in existing:
+            outcomes.append('already_marked')
+        else:
+            outcomes.append('duplicate')
+
+    cache = get_marked_today()
+    for sid, day, _ in events:
+        if sid in students and day == today:
+            cache.add(sid, students[sid].name, today)
+    return outcomes, {sid: student.name for sid, student in students.items()}
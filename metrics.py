@@ -0,0 +1,234 @@
+"""Per-stage timers, counters and queue gauges in the Prometheus text format.
+
+Everything is off unless METRICS_ENABLED is set. While off, timed() hands
+back a shared no-op context manager and inc()/observe() return straight
+away, so the instrumented views pay one function call per stage.
+"""
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+# Seconds; covers a sub-millisecond cache hit up to a slow LLM call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_enabled = None
+_noop = nullcontext()
+_samples = None
+
+
+def is_enabled():
+    global _enabled
+    if _enabled is None:
+        _enabled = bool(getattr(settings, 'METRICS_ENABLED', False))
+    return _enabled
+
+
+def _reset_enabled(setting, **kwargs):
+    global _enabled
+    if setting == 'METRICS_ENABLED':
+        _enabled = None
+
+
+setting_changed.connect(_reset_enabled)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Latency histogram keyed by a tuple of label values"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, [list(s[0]), s[1], s[2]]) for labels, s in self._series.items())
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {total!r}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class Counter:
+    """Monotonic counter keyed by a tuple of label values"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    'faceapp_stage_seconds', 'Time spent in each stage of a request', ('view', 'stage'))
+EVENTS = Counter(
+    'faceapp_events_total', 'Request outcomes, e.g. recognized, unrecognized or already-marked faces',
+    ('view', 'outcome'))
+
+
+def _record(labels, seconds):
+    STAGE_SECONDS.observe(labels, seconds)
+    samples = _samples
+    if samples is not None:
+        samples.setdefault(labels, []).append(seconds)
+
+
+@contextmanager
+def capture():
+    """Turn metrics on for the block and collect every raw duration into {(view, stage): [seconds]}"""
+    global _enabled, _samples
+    samples = {}
+    _samples, _enabled = samples, True
+    try:
+        yield samples
+    finally:
+        _samples, _enabled = None, None
+
+
+def timed(view, stage):
+    """Context manager recording how long the block takes as (view, stage)"""
+    if not is_enabled():
+        return _noop
+    return _Timer((view, stage))
+
+
+class _Timer:
+    __slots__ = ('labels', 'started')
+
+    def __init__(self, labels):
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record(self.labels, time.perf_counter() - self.started)
+
+
+def observe(view, stage, seconds):
+    """Record an already measured duration"""
+    if is_enabled():
+        _record((view, stage), seconds)
+
+
+def inc(view, outcome, amount=1):
+    if is_enabled():
+        EVENTS.inc((view, outcome), amount)
+
+
+def timed_view(view):
+    """Decorator recording the whole view as stage 'total'"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return func(*args, **kwargs)
+            with _Timer((view, 'total')):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_iter(iterable, view, stage):
+    """Pass iterable through, recording the time until it is exhausted, e.g. for a streamed body"""
+    if not is_enabled():
+        return iterable
+    return _timed_iter(iterable, (view, stage))
+
+
+def _timed_iter(iterable, labels):
+    started = time.perf_counter()
+    try:
+        yield from iterable
+    finally:
+        _record(labels, time.perf_counter() - started)
+
+
+def _gauge_lines(name, documentation, kind, value):
+    return [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}', f'{name} {_format_value(value)}']
+
+
+def collect_gauges():
+    """Recognition queue, Sheets outbox and gallery figures, read at scrape time"""
+    from .engine import get_engine
+    from .gallery import get_gallery
+    from .sheets import get_sheet_writer
+
+    engine = get_engine().stats()
+    writer = get_sheet_writer().stats()
+    gallery = get_gallery()
+    return (
+        _gauge_lines('faceapp_recognition_workers', 'Recognition worker threads', 'gauge', engine['workers'])
+        + _gauge_lines('faceapp_recognition_queue_size', 'Frames that may wait for a worker', 'gauge', engine['queue_size'])
+        + _gauge_lines('faceapp_recognition_queued', 'Frames waiting for a worker', 'gauge', engine['queued'])
+        + _gauge_lines('faceapp_recognition_running', 'Frames being recognized', 'gauge', engine['running'])
+        + _gauge_lines('faceapp_recognition_completed_total', 'Frames recognized', 'counter', engine['completed'])
+        + _gauge_lines('faceapp_recognition_rejected_total', 'Frames refused because the queue was full', 'counter', engine['rejected'])
+        + _gauge_lines('faceapp_sheet_outbox_pending', 'Attendance rows waiting for Google Sheets', 'gauge', writer['pending'])
+        + _gauge_lines('faceapp_sheet_rows_sent_total', 'Attendance rows delivered to Google Sheets', 'counter', writer['sent'])
+        + _gauge_lines('faceapp_sheet_failures_total', 'Failed Google Sheets batches', 'counter', writer['failures'])
+        + _gauge_lines('faceapp_gallery_templates', 'Face templates in the gallery', 'gauge', len(gallery))
+        + _gauge_lines('faceapp_gallery_version', 'Gallery snapshot version in use', 'gauge', gallery.version or 0)
+    )
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = STAGE_SECONDS.collect() + EVENTS.collect() + collect_gauges()
+    return '\n'.join(lines) + '\n'
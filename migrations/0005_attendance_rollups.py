@@ -0,0 +1,55 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_rollups(apps, schema_editor):
+    from django.db.models import Count
+    from django.db.models.functions import TruncMonth
+    Attendance = apps.get_model('faceapp', 'Attendance')
+    DailyStatusCount = apps.get_model('faceapp', 'DailyStatusCount')
+    MonthlyStudentCount = apps.get_model('faceapp', 'MonthlyStudentCount')
+    DailyStatusCount.objects.bulk_create(
+        DailyStatusCount(date=row['date'], status=row['status'], count=row['n'])
+        for row in Attendance.objects.values('date', 'status').annotate(n=Count('id')).order_by()
+    )
+    MonthlyStudentCount.objects.bulk_create(
+        MonthlyStudentCount(month=row['month'], student_id=row['student'], status=row['status'], count=row['n'])
+        for row in Attendance.objects.annotate(month=TruncMonth('date'))
+        .values('month', 'student', 'status').annotate(n=Count('id')).order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faceapp', '0004_chathistory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStatusCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('status', models.CharField(max_length=20)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('date', 'status')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyStudentCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('status', models.CharField(max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='faceapp.student')),
+            ],
+            options={
+                'unique_together': {('month', 'student', 'status')},
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
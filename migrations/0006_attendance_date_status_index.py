@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Index for the dashboard, export and rollup queries that filter attendance by date and status.
+
+    (student, date) is already covered by the unique_together index. This
+    is plain SQL so the Attendance model state is left untouched.
+    """
+
+    dependencies = [
+        ('faceapp', '0005_attendance_rollups'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS faceapp_attendance_date_status_idx ON faceapp_attendance (date, status)',
+            reverse_sql='DROP INDEX IF EXISTS faceapp_attendance_date_status_idx',
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Index matching the dashboard's keyset pagination order, (date, time_in, id).
+
+    Each page then seeks to its cursor and reads page_size + 1 rows in index
+    order, with no sort. Plain SQL like 0006, so the model state is untouched.
+    """
+
+    dependencies = [
+        ('faceapp', '0006_attendance_date_status_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS faceapp_attendance_date_time_in_id_idx '
+            'ON faceapp_attendance (date, time_in, id)',
+            reverse_sql='DROP INDEX IF EXISTS faceapp_attendance_date_time_in_id_idx',
+        ),
+    ]
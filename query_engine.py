@@ -0,0 +1,271 @@
+"""Local question answering for the chatbot.
+
+parse_question() turns a question into an Intent (what to compute, which
+statuses, which student, which date range). answer_question() plans it
+against the rollup tables or a narrow ORM query and returns a sentence, or
+None when the question is outside what can be answered locally and should
+go to the LLM.
+"""
+import calendar
+import re
+from datetime import date, timedelta
+
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Attendance
+from . import rollups
+from .dashboard_cache import get_students
+
+STATUS_WORDS = {
+    'present': ('present',),
+    'attended': ('present', 'late'),
+    'attendance': ('present', 'late'),
+    'came': ('present', 'late'),
+    'late': ('late',),
+    'absent': ('absent',),
+    'absence': ('absent',),
+    'absences': ('absent',),
+    'missed': ('absent',),
+}
+MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+ISO_DATE = re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')
+MONTH_DAY = re.compile(r'\b(?:(\d{1,2})\s+([a-z]+)|([a-z]+)\s+(\d{1,2}))(?:st|nd|rd|th)?(?:,?\s+(\d{4}))?\b')
+MONTH_YEAR = re.compile(r'\b(?:in\s+)?([a-z]+)(?:\s+(\d{4}))?\b')
+MAX_LISTED = 50
+# Questions about using the app rather than about the data
+HOW_TO_WORDS = {'export', 'download', 'excel', 'csv', 'register', 'why', 'explain', 'help'}
+
+
+class Intent:
+    """What a question asks for: kind is one of count, who, most, percentage, streak"""
+
+    def __init__(self, kind, statuses=None, student=None, start=None, end=None):
+        self.kind = kind
+        self.statuses = statuses
+        self.student = student
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        student = self.student.student_id if self.student else None
+        return f"Intent({self.kind}, {self.statuses}, {student}, {self.start}, {self.end})"
+
+
+def parse_statuses(words):
+    for word in words:
+        if word in STATUS_WORDS:
+            return STATUS_WORDS[word]
+    return None
+
+
+def parse_date_range(text, today):
+    """(start, end) for the dates a question mentions, or (None, None)"""
+    iso = [date(int(y), int(m), int(d)) for y, m, d in ISO_DATE.findall(text)]
+    if len(iso) >= 2:
+        return min(iso[:2]), max(iso[:2])
+    if iso:
+        return iso[0], iso[0]
+
+    if 'today' in text:
+        return today, today
+    if 'yesterday' in text:
+        day = today - timedelta(days=1)
+        return day, day
+    if 'this week' in text:
+        return today - timedelta(days=today.weekday()), today
+    if 'last week' in text:
+        start = today - timedelta(days=today.weekday() + 7)
+        return start, start + timedelta(days=6)
+    if 'this month' in text:
+        return today.replace(day=1), today
+    if 'last month' in text:
+        end = today.replace(day=1) - timedelta(days=1)
+        return end.replace(day=1), end
+    if 'this year' in text:
+        return today.replace(month=1, day=1), today
+
+    for day_a, month_a, month_b, day_b, year in MONTH_DAY.findall(text):
+        month = MONTHS.get(month_a or month_b)
+        if month:
+            try:
+                day = date(int(year) if year else today.year, month, int(day_a or day_b))
+            except ValueError:
+                continue
+            return day, day
+    for month_name, year in MONTH_YEAR.findall(text):
+        month = MONTHS.get(month_name)
+        # 'may' is also a verb, so it only counts with 'in' or a year
+        if month and (month_name != 'may' or year or f'in {month_name}' in text):
+            year = int(year) if year else today.year
+            return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+    return None, None
+
+
+def find_student(text):
+    """The enrolled student whose name or ID appears in text, preferring the longest match"""
+    best, best_length = None, 0
+    for student in get_students():
+        for token in (student.name, student.student_id):
+            token = (token or '').lower()
+            if len(token) > best_length and re.search(rf'(?<!\w){re.escape(token)}(?!\w)', text):
+                best, best_length = student, len(token)
+    return best
+
+
+def parse_question(question, today=None):
+    """Intent for a question, or None if it doesn't look like a supported query"""
+    today = today or timezone.now().date()
+    text = ' '.join(question.lower().split())
+    words = re.findall(r'[a-z]+', text)
+    if HOW_TO_WORDS & set(words) or text.startswith(('how do', 'how can', 'how to')):
+        return None
+    statuses = parse_statuses(words)
+    student = find_student(text)
+    start, end = parse_date_range(text, today)
+
+    if 'streak' in words:
+        return Intent('streak', statuses or STATUS_WORDS['attended'], student, start, end)
+    if {'percent', 'percentage', 'rate'} & set(words) or '%' in text:
+        return Intent('percentage', statuses or STATUS_WORDS['attended'], student, start, end)
+    if statuses is None:
+        return None
+    if 'who' in words or 'which' in words or 'list' in words:
+        if 'most' in words:
+            return Intent('most', statuses, None, start, end)
+        return Intent('who', statuses, None, start or today, end or today)
+    if 'most' in words:
+        return Intent('most', statuses, None, start, end)
+    if {'how', 'many', 'total', 'count', 'number', 'times'} & set(words) or student:
+        return Intent('count', statuses, student, start, end)
+    return None
+
+
+def _date_filters(intent):
+    if intent.start is None:
+        return {}
+    return {'date__range': (intent.start, intent.end)}
+
+
+def _describe(intent):
+    """Date-range suffix for an answer; the student, if any, is already named in it"""
+    parts = []
+    if intent.start is not None:
+        if intent.start == intent.end:
+            parts.append(f"on {intent.start}")
+        else:
+            parts.append(f"from {intent.start} to {intent.end}")
+    return (' ' + ' '.join(parts)) if parts else ''
+
+
+def _status_label(statuses):
+    return 'attended' if len(statuses) > 1 else statuses[0]
+
+
+def _school_days(intent):
+    """Dates with any attendance recorded in the intent's range, from the daily rollup"""
+    return sorted(set(
+        rollups.DailyStatusCount.objects.filter(count__gt=0, **_date_filters(intent))
+        .values_list('date', flat=True)
+    ))
+
+
+def answer_count(intent):
+    label = _status_label(intent.statuses)
+    if intent.student is None:
+        total = rollups.total(status__in=intent.statuses, **_date_filters(intent))
+        return f"Total {label}: {total}{_describe(intent)}"
+    if intent.start is None:
+        total = sum(
+            row.count for row in rollups.MonthlyStudentCount.objects.filter(
+                student=intent.student, status__in=intent.statuses)
+        )
+    else:
+        total = Attendance.objects.filter(
+            student=intent.student, status__in=intent.statuses, **_date_filters(intent)
+        ).count()
+    return f"{intent.student.name}: {total} day(s) {label}{_describe(intent)}"
+
+
+def answer_who(intent):
+    names = list(
+        Attendance.objects.filter(status__in=intent.statuses, **_date_filters(intent))
+        .values_list('student__name', flat=True).distinct().order_by('student__name')[:MAX_LISTED + 1]
+    )
+    label = _status_label(intent.statuses)
+    if not names:
+        return f"No students {label}{_describe(intent)}."
+    more = ' and others' if len(names) > MAX_LISTED else ''
+    return f"Students {label}{_describe(intent)}: {', '.join(names[:MAX_LISTED])}{more}"
+
+
+def answer_most(intent):
+    if intent.start is None:
+        counts = rollups.student_totals(intent.statuses[0]) if len(intent.statuses) == 1 else []
+    else:
+        counts = []
+    if not counts:
+        counts = list(
+            Attendance.objects.filter(status__in=intent.statuses, **_date_filters(intent))
+            .values('student__name').annotate(total=Count('id')).order_by('-total')
+        )
+    if not counts:
+        return f"No {_status_label(intent.statuses)} records{_describe(intent)}."
+    top = counts[0]['total']
+    names = [row['student__name'] for row in counts if row['total'] == top]
+    noun = 'absences' if intent.statuses == ('absent',) else 'days'
+    return f"Most {_status_label(intent.statuses)}: {', '.join(names)} ({top} {noun}){_describe(intent)}"
+
+
+def answer_percentage(intent):
+    if intent.student is None:
+        everything = rollups.total(**_date_filters(intent))
+        if not everything:
+            return f"No attendance records{_describe(intent)}."
+        share = rollups.total(status__in=intent.statuses, **_date_filters(intent))
+        return f"{share / everything:.1%} of records are {_status_label(intent.statuses)}{_describe(intent)} ({share} of {everything})"
+    days = _school_days(intent)
+    if not days:
+        return f"No attendance records{_describe(intent)}."
+    attended = Attendance.objects.filter(
+        student=intent.student, status__in=intent.statuses, **_date_filters(intent)
+    ).count()
+    return (f"{intent.student.name} {_status_label(intent.statuses)} {attended} of {len(days)} "
+            f"school day(s) ({attended / len(days):.1%}){_describe(intent)}")
+
+
+def answer_streak(intent):
+    if intent.student is None:
+        return None
+    days = _school_days(intent)
+    attended = set(Attendance.objects.filter(
+        student=intent.student, status__in=intent.statuses, **_date_filters(intent)
+    ).values_list('date', flat=True))
+    longest = current = 0
+    for day in days:
+        current = current + 1 if day in attended else 0
+        longest = max(longest, current)
+    return (f"{intent.student.name}: longest streak {longest} school day(s), "
+            f"current streak {current}{_describe(intent)}")
+
+
+PLANNERS = {
+    'count': answer_count,
+    'who': answer_who,
+    'most': answer_most,
+    'percentage': answer_percentage,
+    'streak': answer_streak,
+}
+
+
+def answer_question(question, today=None):
+    """Answer from local data, or None if the LLM is needed"""
+    try:
+        intent = parse_question(question, today)
+    except ValueError:
+        # A date that doesn't exist, such as 2024-02-30
+        return None
+    if intent is None:
+        return None
+    return PLANNERS[intent.kind](intent)
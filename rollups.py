@@ -0,0 +1,177 @@
+"""Attendance summary tables kept up to date as rows are marked and deleted.
+
+DailyStatusCount holds one counter per (date, status) and MonthlyStudentCount
+one per (month, student, status), so dashboard and chatbot totals are lookups
+over a handful of rows instead of scans of the Attendance table.
+
+Saves and deletes of single rows, wherever they come from (views, the admin,
+a student's cascade), are counted by the signal receivers below, connected
+in FaceappConfig.ready(). bulk_create sends no signals, so bulk inserts call
+apply_changes() themselves.
+"""
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import TruncMonth
+
+from .models import Attendance
+
+# Fields an attendance row is counted under
+COUNTED_FIELDS = {'student', 'student_id', 'date', 'status'}
+
+_local = threading.local()
+
+
+class DailyStatusCount(models.Model):
+    date = models.DateField()
+    status = models.CharField(max_length=20)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        app_label = 'faceapp'
+        unique_together = ['date', 'status']
+
+    def __str__(self):
+        return f"{self.date} {self.status}: {self.count}"
+
+
+class MonthlyStudentCount(models.Model):
+    month = models.DateField(help_text='First day of the month')
+    student = models.ForeignKey('faceapp.Student', on_delete=models.CASCADE)
+    status = models.CharField(max_length=20)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        app_label = 'faceapp'
+        unique_together = ['month', 'student', 'status']
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} {self.student_id} {self.status}: {self.count}"
+
+
+def _bump(model, delta, **key):
+    """Add delta to the counter identified by key, creating it if needed"""
+    if model.objects.filter(**key).update(count=F('count') + delta):
+        return
+    if delta <= 0:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(count=delta, **key)
+    except IntegrityError:
+        # Another request created the row first
+        model.objects.filter(**key).update(count=F('count') + delta)
+
+
+def apply_changes(rows, sign=1):
+    """Fold (student_pk, date, status) attendance rows into the counters"""
+    daily = Counter()
+    monthly = Counter()
+    for student_pk, day, status in rows:
+        daily[(day, status)] += sign
+        monthly[(day.replace(day=1), student_pk, status)] += sign
+    for (day, status), delta in daily.items():
+        _bump(DailyStatusCount, delta, date=day, status=status)
+    for (month, student_pk, status), delta in monthly.items():
+        _bump(MonthlyStudentCount, delta, month=month, student_id=student_pk, status=status)
+
+
+def _counted(instance):
+    return instance.student_id, instance.date, instance.status
+
+
+@contextmanager
+def suspended():
+    """Ignore saves and deletes in this thread, for bulk changes followed by rebuild().
+
+    The receivers that drop caches derived from attendance skip them too, so
+    the caller invalidates once at the end.
+    """
+    previous = getattr(_local, 'suspended', False)
+    _local.suspended = True
+    try:
+        yield
+    finally:
+        _local.suspended = previous
+
+
+def is_suspended():
+    return getattr(_local, 'suspended', False)
+
+
+def attendance_pre_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Remember what an existing row was counted under before it changes"""
+    instance._rollup_before = None
+    if raw or is_suspended() or instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not COUNTED_FIELDS & set(update_fields):
+        return
+    instance._rollup_before = (
+        sender.objects.filter(pk=instance.pk).values_list('student_id', 'date', 'status').first())
+
+
+def attendance_saved(sender, instance, created, raw=False, **kwargs):
+    if raw or is_suspended():
+        return
+    before = getattr(instance, '_rollup_before', None)
+    instance._rollup_before = None
+    if created:
+        apply_changes([_counted(instance)])
+    elif before is not None and before != _counted(instance):
+        apply_changes([before], sign=-1)
+        apply_changes([_counted(instance)])
+
+
+def attendance_deleted(sender, instance, **kwargs):
+    if not is_suspended():
+        apply_changes([_counted(instance)], sign=-1)
+
+
+def clear():
+    DailyStatusCount.objects.all().delete()
+    MonthlyStudentCount.objects.all().delete()
+
+
+def rebuild():
+    """Recompute both tables from the Attendance table"""
+    with transaction.atomic():
+        clear()
+        DailyStatusCount.objects.bulk_create(
+            DailyStatusCount(date=row['date'], status=row['status'], count=row['n'])
+            for row in Attendance.objects.values('date', 'status').annotate(n=Count('id')).order_by()
+        )
+        MonthlyStudentCount.objects.bulk_create(
+            MonthlyStudentCount(month=row['month'], student_id=row['student'], status=row['status'], count=row['n'])
+            for row in Attendance.objects.annotate(month=TruncMonth('date'))
+            .values('month', 'student', 'status').annotate(n=Count('id')).order_by()
+        )
+
+
+def total(**filters):
+    """Sum of daily counters, e.g. total(status='present') or total(date__year=2024)"""
+    return DailyStatusCount.objects.filter(**filters).aggregate(n=Sum('count'))['n'] or 0
+
+
+def date_range():
+    """(first, last) date with any attendance, or (None, None)"""
+    days = DailyStatusCount.objects.filter(count__gt=0).aggregate(first=Min('date'), last=Max('date'))
+    return days['first'], days['last']
+
+
+def status_breakdown(**filters):
+    """[{'status': ..., 'count': ...}] over the daily counters"""
+    return list(
+        DailyStatusCount.objects.filter(**filters)
+        .values('status').annotate(count=Sum('count')).filter(count__gt=0).order_by('status')
+    )
+
+
+def student_totals(status, **filters):
+    """[{'student__name': ..., 'total': ...}] for one status, highest first"""
+    return list(
+        MonthlyStudentCount.objects.filter(status=status, **filters)
+        .values('student__name').annotate(total=Sum('count')).filter(total__gt=0).order_by('-total')
+    )
@@ -0,0 +1,229 @@
+"""Write-behind delivery of attendance rows to Google Sheets.
+
+Views only enqueue rows into a durable local outbox (a small SQLite file next
+to the project database). A background flusher reuses one authorized client
+and sends pending rows in append_rows batches, backing off on failure, so a
+slow or unavailable Sheets API never delays the kiosk.
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive'
+]
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_google_sheets_client():
+    """Get Google Sheets client for attendance tracking"""
+    try:
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+        # You'll need to add your credentials.json file
+        creds = ServiceAccountCredentials.from_json_keyfile_name(
+            'credentials.json', SCOPES)
+        client = gspread.authorize(creds)
+        return client
+    except Exception as e:
+        print(f"Google Sheets error: {e}")
+        return None
+
+
+class GoogleSheetBackend:
+    """Appends rows to the first worksheet of 'Attendance Sheet', authorizing once"""
+
+    def __init__(self, spreadsheet='Attendance Sheet'):
+        self.spreadsheet = spreadsheet
+        self._sheet = None
+
+    def append_rows(self, rows):
+        if self._sheet is None:
+            client = get_google_sheets_client()
+            if client is None:
+                raise RuntimeError('Google Sheets client unavailable')
+            self._sheet = client.open(self.spreadsheet).sheet1
+        try:
+            self._sheet.append_rows(rows)
+        except Exception:
+            # Re-authorize on the next attempt in case the token expired
+            self._sheet = None
+            raise
+
+
+class LocalSheetBackend:
+    """In-memory stand-in for the Google sheet, for tests and offline runs"""
+
+    def __init__(self):
+        self.rows = []
+        self.calls = 0
+
+    def append_rows(self, rows):
+        self.calls += 1
+        self.rows.extend(rows)
+
+
+class SheetOutbox:
+    """Durable queue of rows waiting to be sent, safe to share between processes"""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS outbox ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'row TEXT NOT NULL, '
+                'attempts INTEGER NOT NULL DEFAULT 0, '
+                'claimed_until REAL NOT NULL DEFAULT 0)'
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def enqueue(self, rows):
+        with self._connect() as conn:
+            conn.executemany('INSERT INTO outbox (row) VALUES (?)', [(json.dumps(row),) for row in rows])
+
+    def claim(self, limit, lease=60):
+        """Reserve up to limit unclaimed rows for lease seconds; returns [(id, row)]"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            claimed = conn.execute(
+                'SELECT id, row FROM outbox WHERE claimed_until < ? ORDER BY id LIMIT ?',
+                (now, limit)
+            ).fetchall()
+            conn.executemany(
+                'UPDATE outbox SET claimed_until = ? WHERE id = ?',
+                [(now + lease, row_id) for row_id, _ in claimed]
+            )
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return [(row_id, json.loads(row)) for row_id, row in claimed]
+
+    def ack(self, ids):
+        with self._connect() as conn:
+            conn.executemany('DELETE FROM outbox WHERE id = ?', [(row_id,) for row_id in ids])
+
+    def release(self, ids):
+        """Return claimed rows to the queue after a failed send"""
+        with self._connect() as conn:
+            conn.executemany(
+                'UPDATE outbox SET claimed_until = 0, attempts = attempts + 1 WHERE id = ?',
+                [(row_id,) for row_id in ids]
+            )
+
+    def __len__(self):
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+        finally:
+            conn.close()
+
+
+class SheetWriter:
+    """Background flusher draining the outbox into a sheet backend"""
+
+    def __init__(self, outbox, backend, batch_size=100, interval=5.0, max_backoff=300.0):
+        self.outbox = outbox
+        self.backend = backend
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.sent = 0
+        self.failures = 0
+        self._backoff = 0.0
+        # time.monotonic() before which the flusher won't retry after a failure
+        self._next_attempt = 0.0
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def enqueue(self, rows):
+        """Persist rows and nudge the flusher; never blocks on the Sheets API"""
+        self.outbox.enqueue(rows)
+        self.start()
+        self._wakeup.set()
+
+    def flush(self):
+        """Send everything pending now; returns the number of rows delivered"""
+        delivered = 0
+        while True:
+            batch = self.outbox.claim(self.batch_size)
+            if not batch:
+                return delivered
+            ids = [row_id for row_id, _ in batch]
+            try:
+                self.backend.append_rows([row for _, row in batch])
+            except Exception:
+                self.outbox.release(ids)
+                raise
+            self.outbox.ack(ids)
+            delivered += len(batch)
+            self.sent += len(batch)
+
+    def start(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='sheet-writer', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            wait = self._next_attempt - time.monotonic()
+            if wait > 0:
+                # During an outage enqueue() wake-ups don't cut the backoff short
+                time.sleep(wait)
+            else:
+                self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                self._backoff = 0.0
+                self._next_attempt = 0.0
+            except Exception as e:
+                self.failures += 1
+                jittered = max(1.0, self._backoff * 2) * random.uniform(0.8, 1.2)
+                self._backoff = min(self.max_backoff, jittered)
+                self._next_attempt = time.monotonic() + self._backoff
+                print(f"Google Sheets error: {e} (retrying in {self._backoff:.0f}s)")
+
+    def stats(self):
+        return {
+            'pending': len(self.outbox),
+            'sent': self.sent,
+            'failures': self.failures,
+            'backoff_seconds': round(self._backoff, 1),
+        }
+
+
+def get_sheet_writer():
+    """Process-wide writer configured from the ATTENDANCE_SHEET_* settings"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+                outbox_path = getattr(settings, 'ATTENDANCE_SHEET_OUTBOX',
+                                      os.path.join(base_dir, 'sheets_outbox.sqlite3'))
+                backend_path = getattr(settings, 'ATTENDANCE_SHEET_BACKEND', None)
+                backend = import_string(backend_path)() if backend_path else GoogleSheetBackend()
+                _writer = SheetWriter(
+                    SheetOutbox(outbox_path),
+                    backend,
+                    batch_size=getattr(settings, 'ATTENDANCE_SHEET_BATCH_SIZE', 100),
+                    interval=getattr(settings, 'ATTENDANCE_SHEET_FLUSH_INTERVAL', 5.0),
+                )
+    return _writer
@@ -0,0 +1,36 @@
+"""PRAGMAs applied to every new SQLite connection so kiosks, the dashboard and exports can share db.sqlite3.
+
+WAL lets readers run alongside the single writer instead of blocking it,
+synchronous=NORMAL is durable in WAL mode with one fsync per checkpoint
+rather than per commit, and busy_timeout makes a writer wait for the lock
+instead of failing with "database is locked".
+"""
+from django.conf import settings
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'temp_store': 'MEMORY',
+    # Negative means KiB: a 32 MB page cache per connection
+    'cache_size': -32000,
+    'mmap_size': 128 * 1024 * 1024,
+}
+
+
+def get_pragmas():
+    """DEFAULT_PRAGMAS updated with SQLITE_PRAGMAS, or {} if SQLITE_PROFILE is False"""
+    if not getattr(settings, 'SQLITE_PROFILE', True):
+        return {}
+    pragmas = dict(DEFAULT_PRAGMAS)
+    pragmas.update(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    return pragmas
+
+
+def apply_sqlite_profile(sender, connection, **kwargs):
+    """connection_created receiver"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in get_pragmas().items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -3,10 +3,16 @@ from . import views
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('kiosk/', views.kiosk, name='kiosk'),
     path('upload_image/', views.upload_image, name='upload_image'),
+    path('sync_attendance/', views.sync_attendance, name='sync_attendance'),
+    path('recognition_status/', views.recognition_status, name='recognition_status'),
+    path('metrics/', views.prometheus_metrics, name='metrics'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('export/', views.export_excel, name='export'),
     path('chatbot/', views.chatbot, name='chatbot'),
+    path('export_chat_history/', views.export_chat_history, name='export_chat_history'),
+    path('student_thumbnail/<int:student_id>/', views.student_thumbnail, name='student_thumbnail'),
     path('delete_student/<int:student_id>/', views.delete_student, name='delete_student'),
     path('delete_attendance/<int:attendance_id>/', views.delete_attendance, name='delete_attendance'),
     path('reset_database/', views.reset_database, name='reset_database'),
@@ -1,99 +1,282 @@
 from django.shortcuts import render, redirect
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.utils import timezone
-from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.core import signing
+from django.utils.dateparse import parse_datetime
+from datetime import date as dt_date, datetime, timedelta, timezone as dt_timezone
+from urllib.parse import urlencode
+from django.utils.cache import get_conditional_response, patch_cache_control
+import zlib
 import json
 import base64
-import cv2
-import numpy as np
 import os
-import pandas as pd
-from .models import Student, Attendance
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import io
-from PIL import Image
-
-# Google Sheets setup (you'll need to add your credentials)
-SCOPES = [
-    'https://www.googleapis.com/auth/spreadsheets',
-    'https://www.googleapis.com/auth/drive'
-]
-
-def get_google_sheets_client():
-    """Get Google Sheets client for attendance tracking"""
+import time
+from .models import Student, Attendance, ChatHistory
+from .engine import get_engine, EngineBusy
+from concurrent.futures import TimeoutError as FutureTimeout
+from .sheets import get_sheet_writer
+from .exports import (
+    ATTENDANCE_HEADER, EXPORT_CHUNK_SIZE, attendance_rows, with_empty_note, csv_response, xlsx_response, parquet_response
+)
+from .keyset import keyset_page, DEFAULT_PAGE_SIZE
+from .dashboard_cache import get_attendance_dates, get_students, invalidate_attendance_dates, invalidate_students
+from . import rollups
+from .assistant import get_analytics_context, get_cached_answer, set_cached_answer, get_llm_client, bump_data_version
+from .query_engine import answer_question
+from .marking import get_marked_today, mark_student_present, mark_students_present, record_attendance_events
+from . import metrics
+
+# OpenCV, NumPy and PIL are imported inside the functions that use them,
+# so importing this module (and every manage.py command) stays cheap
+
+def append_to_google_sheet(rows):
+    """Queue [name, date, time] rows for the attendance sheet; delivery happens in the background"""
     try:
-        # You'll need to add your credentials.json file
-        creds = ServiceAccountCredentials.from_json_keyfile_name(
-            'credentials.json', SCOPES)
-        client = gspread.authorize(creds)
-        return client
+        with metrics.timed('upload_image', 'sheets'):
+            get_sheet_writer().enqueue(rows)
     except Exception as e:
         print(f"Google Sheets error: {e}")
+
+FRAME_CONTENT_TYPES = ('image/jpeg', 'image/png', 'application/octet-stream')
+
+def read_frame_bytes(request):
+    """Encoded frame from a raw image body, a multipart upload or the legacy base64 JSON payload"""
+    if request.content_type in FRAME_CONTENT_TYPES:
+        # request.body is already the encoded image, no decoding needed
+        return request.body
+    if request.content_type == 'multipart/form-data':
+        upload = request.FILES['image']
+        if hasattr(upload.file, 'getbuffer'):
+            return upload.file.getbuffer()
+        return upload.read()
+    data = json.loads(request.body)
+    image_data = data['image'].split(',')[1]
+    return base64.b64decode(image_data)
+
+def read_group_frames(request, max_frames):
+    """Encoded frames for group mode: every multipart 'image' file, a JSON 'images' list, or a single frame.
+
+    Returns None if there are more than max_frames, before reading any of them.
+    """
+    if request.content_type == 'multipart/form-data':
+        uploads = request.FILES.getlist('image')
+        if len(uploads) > max_frames:
+            return None
+        return [upload.read() for upload in uploads]
+    if request.content_type in FRAME_CONTENT_TYPES:
+        return [request.body]
+    data = json.loads(request.body)
+    images = data.get('images') or [data['image']]
+    if len(images) > max_frames:
         return None
+    return [base64.b64decode(image.split(',')[1]) for image in images]
+
+def is_group_request(request):
+    """Group mode is requested with ?mode=group (or a 'mode' form field on multipart uploads)"""
+    if request.GET.get('mode') == 'group':
+        return True
+    return request.content_type == 'multipart/form-data' and request.POST.get('mode') == 'group'
+
+def read_roi(request):
+    """Optional face hint 'x,y,w,h' in frame pixels, from ?roi=, an X-Face-ROI header or a multipart field"""
+    value = request.GET.get('roi') or request.headers.get('X-Face-ROI')
+    if not value and request.content_type == 'multipart/form-data':
+        value = request.POST.get('roi')
+    from .frames import parse_roi
+    return parse_roi(value)
+
+def read_kiosk_id(request):
+    """Which kiosk sent a frame: ?kiosk=, an X-Kiosk-ID header, or else the client address"""
+    return request.GET.get('kiosk') or request.headers.get('X-Kiosk-ID') or request.META.get('REMOTE_ADDR', '')
+
+def recognize_frame(img_bytes, roi=None, kiosk=None):
+    """Decode and identify a single-face frame; runs on a recognition worker.
+
+    With a kiosk, a face this kiosk sent moments ago is answered from the frame cache.
+    """
+    from .frame_cache import face_hash, get_frame_cache
+    from .frames import prepare_frame
+    from .gallery import get_gallery
+    with metrics.timed('recognition', 'decode'):
+        frame = prepare_frame(img_bytes, roi)
+    gallery = get_gallery()
+    cache = get_frame_cache() if kiosk is not None else None
+    if cache is None:
+        return gallery.match(frame.image, region=frame.region, with_score=True)
+
+    with metrics.timed('recognition', 'detect'):
+        box = gallery.find_face(frame.image, frame.region)
+    if box is None:
+        return None, 'No face detected', None
+    key = face_hash(frame.image, box)
+    generation = gallery.generation
+    result = cache.get(kiosk, key, generation)
+    if result is not None:
+        metrics.inc('upload_image', 'frame_cache_hit')
+        student_id, recog_info, score = result
+        return student_id, f"{recog_info} (repeated frame)", score
+    metrics.inc('upload_image', 'frame_cache_miss')
+    result = gallery.match(frame.image, with_score=True, box=box)
+    cache.put(kiosk, key, generation, result)
+    return result
+
+def recognize_group_frames(frames):
+    """Decode and identify every face in a batch of frames; runs on a recognition worker"""
+    from .frames import prepare_frame
+    from .gallery import get_gallery
+    gallery = get_gallery()
+    faces = []
+    for frame_no, img_bytes in enumerate(frames):
+        try:
+            with metrics.timed('recognition', 'decode'):
+                frame = prepare_frame(img_bytes)
+        except ValueError:
+            continue
+        for box, student_id, score in gallery.match_all(frame.image):
+            faces.append({
+                'frame': frame_no,
+                'box': list(frame.to_original(box)),
+                'student_id': student_id,
+                'score': round(score, 3),
+            })
+    return faces
+
+def run_recognition(fn, *args):
+    """Run fn on the recognition engine, raising EngineBusy if it is saturated"""
+    timeout = getattr(settings, 'RECOGNITION_TIMEOUT', 10)
+    try:
+        return get_engine().run(fn, *args, timeout=timeout)
+    except FutureTimeout:
+        raise EngineBusy('Recognition timed out')
+
+def busy_response():
+    """Fast 503 telling the kiosk to retry shortly"""
+    metrics.inc('upload_image', 'busy')
+    response = JsonResponse({
+        'success': False,
+        'busy': True,
+        'message': 'Server is busy, please try again in a moment.'
+    }, status=503)
+    response['Retry-After'] = '1'
+    return response
+
+def upload_group(request):
+    """Recognize every face in one or more frames and mark all of them in one pass"""
+    # One request holds a recognition worker for all its frames, so their number is capped
+    max_frames = getattr(settings, 'GROUP_MAX_FRAMES', 10)
+    with metrics.timed('upload_image', 'read'):
+        frames = read_group_frames(request, max_frames)
+    if frames is None:
+        return JsonResponse({'success': False, 'message': f"At most {max_frames} frames per group request."},
+                            status=400)
+    try:
+        with metrics.timed('upload_image', 'recognize'):
+            faces = run_recognition(recognize_group_frames, frames)
+    except EngineBusy:
+        return busy_response()
+
+    today = timezone.now().date()
+    recognized = {face['student_id'] for face in faces if face['student_id']}
+    with metrics.timed('upload_image', 'mark'):
+        names, newly_marked = mark_students_present(recognized, today) if recognized else ({}, set())
+
+    for face in faces:
+        face['name'] = names.get(face['student_id'])
+        if not face['student_id']:
+            face['status'] = 'unrecognized'
+        elif face['student_id'] in newly_marked:
+            face['status'] = 'marked'
+        else:
+            face['status'] = 'already_marked'
+
+    if newly_marked:
+        time_now = timezone.now().strftime('%H:%M:%S')
+        append_to_google_sheet([
+            [names[sid], today.strftime('%Y-%m-%d'), time_now] for sid in sorted(newly_marked)
+        ])
+
+    unrecognized = sum(1 for face in faces if not face['student_id'])
+    metrics.inc('upload_image', 'recognized', len(newly_marked))
+    metrics.inc('upload_image', 'already_marked', len(recognized) - len(newly_marked))
+    metrics.inc('upload_image', 'unrecognized', unrecognized)
+    return JsonResponse({
+        'success': bool(newly_marked),
+        'message': (f"{len(faces)} face(s) detected: {len(newly_marked)} marked, "
+                    f"{len(recognized) - len(newly_marked)} already marked, {unrecognized} not recognized."),
+        'faces': faces
+    })
 
 def home(request):
     """Home page with webcam interface"""
     return render(request, 'home.html')
 
+def kiosk(request):
+    """Hands-free kiosk page streaming frames over the kiosk WebSocket"""
+    from .kiosk import KIOSK_WS_PATH
+    return render(request, 'kiosk.html', {
+        'websocket_path': KIOSK_WS_PATH,
+        'frames_per_second': getattr(settings, 'KIOSK_FRAMES_PER_SECOND', 3),
+    })
+
 @csrf_exempt
+@metrics.timed_view('upload_image')
 def upload_image(request):
     """Handle image upload and face recognition"""
     if request.method == 'POST':
         try:
-            data = json.loads(request.body)
-            image_data = data['image'].split(',')[1]
-            img_bytes = base64.b64decode(image_data)
-            
-            # Convert to OpenCV format
-            nparr = np.frombuffer(img_bytes, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            if is_group_request(request):
+                return upload_group(request)
+
+            with metrics.timed('upload_image', 'read'):
+                img_bytes = read_frame_bytes(request)
             
-            # Use real face recognition
-            from .face_utils import recognize_face
-            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            known_faces_dir = os.path.join(base_dir, 'known_faces')
-            student_id, recog_info = recognize_face(img, known_faces_dir)
+            # Decode and match against the in-memory gallery on a worker thread;
+            # a repeat of a face this kiosk just sent reuses its result
+            try:
+                with metrics.timed('upload_image', 'recognize'):
+                    student_id, recog_info, score = run_recognition(
+                        recognize_frame, img_bytes, read_roi(request), read_kiosk_id(request))
+            except EngineBusy:
+                return busy_response()
+            if student_id and request.GET.get('defer'):
+                # The kiosk queues the signed scan and marks it through sync_attendance
+                metrics.inc('upload_image', 'deferred')
+                return JsonResponse({
+                    'success': True,
+                    'deferred': True,
+                    'token': make_scan_token(student_id, score, read_kiosk_id(request)),
+                    'student_id': student_id,
+                    'confidence': round(score, 3),
+                    'message': f"Recognized {student_id}.",
+                    'recognition': recog_info
+                })
             today = timezone.now().date()
             if student_id:
-                # Try to find student by student_id
-                student = Student.objects.filter(student_id=student_id).first()
-                if not student:
-                    # If not found, create a new student with this ID
-                    student = Student.objects.create(
-                        name=student_id,
-                        student_id=student_id
-                    )
-                existing_attendance = Attendance.objects.filter(
-                    student=student,
-                    date=today
-                ).first()
-                if not existing_attendance:
-                    attendance = Attendance.objects.create(
-                        student=student,
-                        date=today,
-                        status='present'
-                    )
+                # Repeat scans are answered from the per-day cache without a query
+                with metrics.timed('upload_image', 'mark'):
+                    student_name, created = mark_student_present(student_id, today)
+                metrics.inc('upload_image', 'recognized' if created else 'already_marked')
+                if created:
                     # Try to save to Google Sheets
-                    try:
-                        client = get_google_sheets_client()
-                        if client:
-                            sheet = client.open('Attendance Sheet').sheet1
-                            sheet.append_row([student.name, today.strftime('%Y-%m-%d'), timezone.now().strftime('%H:%M:%S')])
-                    except Exception as e:
-                        print(f"Google Sheets error: {e}")
+                    append_to_google_sheet([[student_name, today.strftime('%Y-%m-%d'), timezone.now().strftime('%H:%M:%S')]])
                     return JsonResponse({
                         'success': True,
-                        'message': f"{student.name}'s attendance marked successfully!"
+                        'message': f"{student_name}'s attendance marked successfully!",
+                        'recognition': recog_info
                     })
                 else:
                     return JsonResponse({
                         'success': False,
-                        'message': f"{student.name}'s attendance already marked today."
+                        'message': f"{student_name}'s attendance already marked today.",
+                        'recognition': recog_info
                     })
             else:
+                metrics.inc('upload_image', 'unrecognized')
                 return JsonResponse({
                     'success': False,
                     'message': f"Face not recognized: {recog_info}"
@@ -107,6 +290,144 @@ def upload_image(request):
     
     return JsonResponse({'success': False, 'message': 'Invalid request method'})
 
+SYNC_STATUSES = ('marked', 'already_marked', 'duplicate', 'unknown_student', 'low_confidence', 'invalid')
+SCAN_TOKEN_SALT = 'faceapp.scan'
+
+def make_scan_token(student_id, score, kiosk):
+    """Signed record of a recognition, the only thing sync_attendance accepts as a scan"""
+    return signing.dumps({
+        's': student_id,
+        'c': round(score, 3) if score is not None else None,
+        'k': kiosk,
+        't': int(time.time() * 1000),
+    }, salt=SCAN_TOKEN_SALT)
+
+def read_scan_token(token, max_age):
+    """Payload of a scan token, or None if it is missing, forged or older than max_age"""
+    if not isinstance(token, str):
+        return None
+    try:
+        scan = signing.loads(token, salt=SCAN_TOKEN_SALT, max_age=max_age)
+    except signing.BadSignature:
+        return None
+    return scan if isinstance(scan, dict) and scan.get('s') else None
+
+def parse_event_time(value, now):
+    """Scan time of a synced event from an ISO 8601 string or epoch milliseconds, comparable to now"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        try:
+            scanned_at = datetime.fromtimestamp(value / 1000, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    elif isinstance(value, str):
+        try:
+            scanned_at = parse_datetime(value)
+        except ValueError:
+            return None
+        if scanned_at is None:
+            return None
+    else:
+        return None
+    if timezone.is_aware(now):
+        if timezone.is_naive(scanned_at):
+            scanned_at = timezone.make_aware(scanned_at)
+        return scanned_at.astimezone(now.tzinfo)
+    return timezone.make_naive(scanned_at) if timezone.is_aware(scanned_at) else scanned_at
+
+@csrf_exempt
+@metrics.timed_view('sync_attendance')
+def sync_attendance(request):
+    """Apply a batch of attendance events queued by kiosks; returns one outcome per event.
+
+    Body: {"events": [{"token"}, ...]} with the tokens upload_image?defer=1
+    returned. The student, confidence, kiosk and scan time all come from the
+    signed token, so an event can only mark a scan the server recognized.
+    Replaying a batch is harmless: each student is marked at most once per day.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Invalid request method'}, status=405)
+    try:
+        events = json.loads(request.body).get('events')
+    except (ValueError, AttributeError):
+        events = None
+    if not isinstance(events, list):
+        return JsonResponse({'success': False, 'message': 'Expected a JSON object with an "events" list.'}, status=400)
+    max_events = getattr(settings, 'ATTENDANCE_SYNC_MAX_EVENTS', 500)
+    if len(events) > max_events:
+        return JsonResponse({'success': False, 'message': f"At most {max_events} events per batch."}, status=400)
+
+    now = timezone.now()
+    max_age = timedelta(days=getattr(settings, 'ATTENDANCE_SYNC_MAX_AGE_DAYS', 7))
+    min_confidence = getattr(settings, 'ATTENDANCE_SYNC_MIN_CONFIDENCE', None)
+    if min_confidence is None:
+        from .gallery import match_threshold
+        min_confidence = match_threshold()
+
+    results = []
+    valid = []
+    for index, event in enumerate(events):
+        result = {'index': index}
+        results.append(result)
+        scan = read_scan_token(event.get('token') if isinstance(event, dict) else None, max_age)
+        if scan is None:
+            result.update(status='invalid', message='a valid, unexpired scan token is required')
+            continue
+        student_id = str(scan['s'])
+        result.update(student_id=student_id, kiosk=str(scan.get('k') or ''))
+        scanned_at = parse_event_time(scan.get('t'), now)
+        confidence = scan.get('c')
+        if scanned_at is None:
+            result.update(status='invalid', message='scan time is invalid')
+        elif confidence is not None and confidence < min_confidence:
+            result.update(status='low_confidence')
+        else:
+            valid.append((result, student_id, scanned_at))
+
+    today = now.date()
+    with metrics.timed('sync_attendance', 'mark'):
+        with transaction.atomic():
+            outcomes, names = record_attendance_events(
+                [(student_id, scanned_at.date(), timezone.localtime(scanned_at).time()
+                  if timezone.is_aware(scanned_at) else scanned_at.time())
+                 for _, student_id, scanned_at in valid],
+                today
+            )
+    sheet_rows = []
+    for (result, student_id, scanned_at), outcome in zip(valid, outcomes):
+        result['status'] = outcome
+        result['date'] = scanned_at.date().isoformat()
+        if student_id in names:
+            result['name'] = names[student_id]
+        if outcome == 'marked':
+            sheet_rows.append([names[student_id], scanned_at.date().strftime('%Y-%m-%d'), scanned_at.strftime('%H:%M:%S')])
+    if sheet_rows:
+        append_to_google_sheet(sheet_rows)
+
+    counts = {status: 0 for status in SYNC_STATUSES}
+    for result in results:
+        counts[result['status']] += 1
+    for status, count in counts.items():
+        if count:
+            metrics.inc('sync_attendance', status, count)
+    return JsonResponse({'success': True, 'counts': counts, 'results': results})
+
+def recognition_status(request):
+    """Queue depth and wait times of the recognition engine, and repeated-frame cache hits"""
+    from .frame_cache import get_frame_cache
+    status = get_engine().stats()
+    cache = get_frame_cache()
+    status['frame_cache'] = cache.stats() if cache is not None else None
+    return JsonResponse(status)
+
+def prometheus_metrics(request):
+    """Stage timings, outcome counters and queue gauges for Prometheus; 404 unless METRICS_ENABLED"""
+    if not metrics.is_enabled():
+        return HttpResponse('Metrics are disabled.', status=404, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@metrics.timed_view('dashboard')
 def dashboard(request):
     """Admin dashboard to view attendance"""
     # Get filter parameters
@@ -115,7 +436,7 @@ def dashboard(request):
     month_filter = request.GET.get('month', '')
     
     # Get attendance records
-    attendance_list = Attendance.objects.select_related('student').all().order_by('-date', '-time_in')
+    attendance_list = Attendance.objects.select_related('student').all()
     
     # Apply filters
     if date_filter:
@@ -128,37 +449,121 @@ def dashboard(request):
         year, month = month_filter.split('-')
         attendance_list = attendance_list.filter(date__year=year, date__month=month)
     
-    # Get unique dates for filter dropdown
-    dates = Attendance.objects.values_list('date', flat=True).distinct().order_by('-date')
+    # Totals come from the daily rollup unless a name filter needs the raw table
+    with metrics.timed('dashboard', 'totals'):
+        if name_filter:
+            total_records = attendance_list.count()
+        else:
+            rollup_filters = {}
+            if date_filter:
+                rollup_filters['date'] = date_filter
+            if month_filter:
+                rollup_filters.update(date__year=year, date__month=month)
+            total_records = rollups.total(**rollup_filters)
     
-    # Get unique students for filter dropdown
-    students = Student.objects.all().order_by('name')
+    # One page at a time, keyed on (date, time_in, id)
+    page_size = getattr(settings, 'DASHBOARD_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    with metrics.timed('dashboard', 'page'):
+        page, next_cursor, previous_cursor = keyset_page(
+            attendance_list,
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+            page_size=page_size
+        )
     
-    # Get all registered students for the students table
-    all_students = Student.objects.all().order_by('name')
+    with metrics.timed('dashboard', 'dropdowns'):
+        # Unique dates for the filter dropdown
+        dates = get_attendance_dates()
+        
+        # One cached student list serves both the filter dropdown and the students table
+        students = get_students()
+        from .thumbnails import thumbnail_url
+        for student in students:
+            student.thumbnail_url = thumbnail_url(student)
     
-    # Count late students today
+    # Count present and late students today
     today = timezone.now().date()
-    late_count = Attendance.objects.filter(date=today, status='Late').count()
+    with metrics.timed('dashboard', 'today'):
+        present_today = rollups.total(date=today)
+        late_count = rollups.total(date=today, status__iexact='late')
+    
+    # Filters carried over to the pagination links
+    filter_query = urlencode({k: v for k, v in (('date', date_filter), ('name', name_filter), ('month', month_filter)) if v})
     
     context = {
-        'attendance_list': attendance_list,
+        'attendance_list': page,
+        'total_records': total_records,
+        'present_today': present_today,
+        'next_cursor': next_cursor,
+        'previous_cursor': previous_cursor,
+        'filter_query': filter_query,
         'dates': dates,
         'students': students,
-        'all_students': all_students,
+        'all_students': students,
         'date_filter': date_filter,
         'name_filter': name_filter,
         'month_filter': month_filter,
         'late_count': late_count,
     }
     
-    return render(request, 'dashboard.html', context)
+    with metrics.timed('dashboard', 'render'):
+        return render(request, 'dashboard.html', context)
+
+THUMBNAIL_MAX_AGE = 365 * 24 * 60 * 60
+
+def student_thumbnail(request, student_id):
+    """Square thumbnail of a student's photo; cacheable for a year under its versioned URL, with an ETag"""
+    from .thumbnails import make_thumbnail, read_thumbnail, thumbnail_version
+    version = request.GET.get('v', '')
+    content = None
+    if len(version) == 8 and all(c in '0123456789abcdef' for c in version):
+        # The usual case needs no query: the URL names the stored file
+        content = read_thumbnail(student_id, version)
+    if content is None:
+        # Missing, not backfilled yet or an outdated URL: (re)create from the current photo
+        try:
+            student = Student.objects.get(id=student_id)
+        except Student.DoesNotExist:
+            raise Http404('Student not found')
+        if not student.photo:
+            raise Http404('Student has no photo')
+        current = thumbnail_version(student)
+        try:
+            make_thumbnail(student)
+        except Exception as e:
+            print(f"Error creating thumbnail for {student.student_id}: {e}")
+            raise Http404('Thumbnail unavailable')
+        content = read_thumbnail(student_id, current)
+        if content is None:
+            raise Http404('Thumbnail unavailable')
+        immutable = version == current
+    else:
+        immutable = True
+
+    etag = f'"{zlib.crc32(content):08x}-{len(content)}"'
+    response = get_conditional_response(request, etag=etag) or HttpResponse(content, content_type='image/jpeg')
+    response['ETag'] = etag
+    if immutable:
+        patch_cache_control(response, public=True, max_age=THUMBNAIL_MAX_AGE, immutable=True)
+    else:
+        # An unversioned or outdated URL must be revalidated with the ETag
+        patch_cache_control(response, no_cache=True)
+    return response
 
+@metrics.timed_view('export_excel')
 def export_excel(request):
-    """Export attendance data to Excel"""
+    """Export attendance data as Excel, CSV or Parquet, reading rows in chunks.
+
+    Only CSV is streamed: its first row goes out before the query finishes.
+    xlsx and Parquet files are only complete once their last part (the zip
+    directory openpyxl writes in save(), the Parquet footer) exists, so those
+    are built in a temp file first. Memory stays flat, but the first byte
+    waits for the whole export.
+    """
     export_type = request.GET.get('type', 'all')
     date_value = request.GET.get('date', '')
     month_value = request.GET.get('month', '')
+    export_format = request.GET.get('format', 'xlsx')
     
     # Get attendance data based on export type
     if export_type == 'date' and date_value:
@@ -168,50 +573,27 @@ def export_excel(request):
         attendance_list = Attendance.objects.filter(date__year=year, date__month=month)
     else:
         attendance_list = Attendance.objects.all()
-    
-    # Create DataFrame
-    data = []
-    for attendance in attendance_list:
-        data.append({
-            'Student Name': getattr(attendance.student, 'name', ''),
-            'Student ID': getattr(attendance.student, 'student_id', ''),
-            'Date': attendance.date.strftime('%Y-%m-%d') if attendance.date else '',
-            'Time In': attendance.time_in.strftime('%H:%M:%S') if attendance.time_in else '',
-            'Status': attendance.status if attendance.status else '',
-        })
-
-    # If no records, add a note row
-    if not data:
-        data.append({
-            'Student Name': 'No attendance records found',
-            'Student ID': '',
-            'Date': '',
-            'Time In': '',
-            'Status': ''
-        })
-
-    df = pd.DataFrame(data)
-
-    # Create Excel file
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Attendance', index=False)
-    output.seek(0)
-
-    # Create response
-    filename = f"attendance_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response = HttpResponse(
-        output.read(),
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
 
-    return response
+    rows = attendance_rows(attendance_list)
+    filename = f"attendance_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
 
+    if export_format == 'csv':
+        # The body is written while streaming, after the view has returned
+        rows = metrics.timed_iter(rows, 'export_excel', 'stream_csv')
+        return csv_response(ATTENDANCE_HEADER, with_empty_note(rows, 'No attendance records found'), f"{filename}.csv")
+    if export_format == 'parquet':
+        try:
+            with metrics.timed('export_excel', 'write_parquet'):
+                return parquet_response(ATTENDANCE_HEADER, rows, f"{filename}.parquet")
+        except ImportError:
+            return HttpResponse('Parquet export requires the pyarrow package.', status=501)
+    with metrics.timed('export_excel', 'write_xlsx'):
+        return xlsx_response(ATTENDANCE_HEADER, with_empty_note(rows, 'No attendance records found'), f"{filename}.xlsx")
+
+@metrics.timed_view('chatbot')
 def chatbot(request):
     """LLM-powered assistant for attendance analysis, logs Q&A, summarizes all data"""
     import traceback
-    from openai import OpenAI
     from django.conf import settings
     from .models import Attendance, Student, ChatHistory
     from django.utils import timezone
@@ -221,62 +603,29 @@ def chatbot(request):
             data = json.loads(request.body)
             user_query = data.get('query', '').strip().lower()
 
-            # Database-driven Q&A for common attendance questions
-            from django.db.models import Count
-            db_answer = None
-            if 'total present' in user_query or 'how many present' in user_query:
-                total_present = Attendance.objects.filter(status='present').count()
-                db_answer = f"Total present: {total_present}"
-            elif 'most absent' in user_query or 'most absences' in user_query:
-                absent_counts = (Attendance.objects.filter(status='absent')
-                    .values('student__name')
-                    .annotate(total=Count('id'))
-                    .order_by('-total'))
-                if absent_counts:
-                    max_absent = absent_counts[0]['total']
-                    most_absent = [a['student__name'] for a in absent_counts if a['total'] == max_absent]
-                    db_answer = f"Most absent: {', '.join(most_absent)} ({max_absent} absences)"
-                else:
-                    db_answer = "No absences recorded."
-            elif 'total absent' in user_query or 'how many absent' in user_query:
-                total_absent = Attendance.objects.filter(status='absent').count()
-                db_answer = f"Total absent: {total_absent}"
-            elif 'total late' in user_query or 'how many late' in user_query:
-                total_late = Attendance.objects.filter(status='late').count()
-                db_answer = f"Total late: {total_late}"
-            # Add more database-driven Q&A as needed
+            # Repeated questions are answered from the cache until attendance changes
+            with metrics.timed('chatbot', 'answer_cache'):
+                cached_answer = get_cached_answer(user_query)
+            if cached_answer:
+                metrics.inc('chatbot', 'cached')
+                with metrics.timed('chatbot', 'log'):
+                    ChatHistory.objects.create(question=user_query, answer=cached_answer)
+                return JsonResponse({'response': cached_answer})
+
+            # Structured questions are answered locally from the rollups and ORM
+            with metrics.timed('chatbot', 'query_engine'):
+                db_answer = answer_question(user_query)
 
             if db_answer:
-                ChatHistory.objects.create(question=user_query, answer=db_answer)
+                metrics.inc('chatbot', 'local')
+                with metrics.timed('chatbot', 'log'):
+                    ChatHistory.objects.create(question=user_query, answer=db_answer)
                 return JsonResponse({'response': db_answer})
 
             # --- LLM fallback for complex/natural questions ---
-            # Summarize all attendance data for context
-            all_records = Attendance.objects.select_related('student').all()
-            total_attendance = all_records.count()
-            unique_students = Student.objects.count()
-            date_range = (all_records.order_by('date').first(), all_records.order_by('-date').first()) if total_attendance else (None, None)
-            status_counts = all_records.values('status').order_by().annotate(count=models.Count('status'))
-            status_summary = ', '.join([f"{s['status']}: {s['count']}" for s in status_counts]) if status_counts else 'No records.'
-
-            summary = f"Total records: {total_attendance}, Unique students: {unique_students}, Status breakdown: {status_summary}."
-            if date_range[0] and date_range[1]:
-                summary += f" Date range: {date_range[0].date} to {date_range[1].date}."
-
-            # Gather recent attendance records (for detailed context)
-            attendance_records = all_records.order_by('-date', '-time_in')[:100]
-            records = []
-            for att in attendance_records:
-                records.append({
-                    'Student Name': att.student.name,
-                    'Student ID': att.student.student_id,
-                    'Date': att.date.strftime('%Y-%m-%d') if att.date else '',
-                    'Time In': att.time_in.strftime('%H:%M:%S') if att.time_in else '',
-                    'Status': att.status if att.status else '',
-                })
-            data_table = '\n'.join([
-                f"{r['Student Name']} | {r['Student ID']} | {r['Date']} | {r['Time In']} | {r['Status']}" for r in records
-            ])
+            # Summary and recent records, cached per data version
+            with metrics.timed('chatbot', 'context'):
+                summary, data_table = get_analytics_context()
 
             prompt = f"""
 You are an attendance assistant for a school. Here is a summary of all attendance data:
@@ -291,24 +640,27 @@ A user asked: '{user_query}'
 Based on the summary and the data above, answer the question as helpfully as possible. If the answer requires calculation or listing, do so. If you can't answer from the data, say so politely.
 """
 
-            # Get OpenAI API key from Django settings
-            api_key = getattr(settings, 'OPENAI_API_KEY', None)
-            if not api_key:
+            # Shared client built from OPENAI_API_KEY in Django settings
+            client = get_llm_client()
+            if client is None:
                 return JsonResponse({'response': 'OpenAI API key not set. Please configure OPENAI_API_KEY in settings.'})
-            client = OpenAI(api_key=api_key)
 
             # Call GPT-4o
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "system", "content": "You are a helpful assistant for attendance analytics."},
-                          {"role": "user", "content": prompt}],
-                max_tokens=400,
-                temperature=0.2
-            )
+            with metrics.timed('chatbot', 'llm'):
+                response = client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=[{"role": "system", "content": "You are a helpful assistant for attendance analytics."},
+                              {"role": "user", "content": prompt}],
+                    max_tokens=400,
+                    temperature=0.2
+                )
             answer = response.choices[0].message.content.strip()
+            set_cached_answer(user_query, answer)
+            metrics.inc('chatbot', 'llm')
 
             # Log Q&A to ChatHistory
-            ChatHistory.objects.create(question=user_query, answer=answer)
+            with metrics.timed('chatbot', 'log'):
+                ChatHistory.objects.create(question=user_query, answer=answer)
 
             return JsonResponse({'response': answer})
         except Exception as e:
@@ -319,20 +671,26 @@ Based on the summary and the data above, answer the question as helpfully as pos
             return JsonResponse({'response': 'Sorry, I encountered an internal error. Please contact admin or try again later.'}, status=500)
     return JsonResponse({'response': 'Invalid request'}, status=400)
 
-# Export chat history as CSV
-from django.http import StreamingHttpResponse
-import csv
+def chat_history_rows(queryset):
+    """CSV rows for a ChatHistory queryset, fetched in chunks"""
+    values = queryset.values_list('timestamp', 'question', 'answer')
+    for timestamp, question, answer in values.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield [timestamp.strftime('%Y-%m-%d %H:%M:%S'), question, answer]
 
+@staff_member_required
 def export_chat_history(request):
-    """Export chat Q&A log as CSV"""
-    rows = ChatHistory.objects.order_by('-timestamp').all()
-    def row_iter():
-        yield ['Timestamp', 'Question', 'Answer']
-        for r in rows:
-            yield [r.timestamp.strftime('%Y-%m-%d %H:%M:%S'), r.question, r.answer]
-    response = StreamingHttpResponse((csv.writer(response := io.StringIO()).writerow(row) or response.getvalue() for row in row_iter()), content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="chat_history.csv"'
-    return response
+    """Export chat Q&A log as CSV, optionally limited to ?start=YYYY-MM-DD&end=YYYY-MM-DD"""
+    rows = ChatHistory.objects.order_by('-timestamp')
+    try:
+        start = dt_date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = dt_date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+    except ValueError:
+        return HttpResponse('start and end must be dates like 2024-01-31.', status=400, content_type='text/plain')
+    if start:
+        rows = rows.filter(timestamp__date__gte=start)
+    if end:
+        rows = rows.filter(timestamp__date__lte=end)
+    return csv_response(['Timestamp', 'Question', 'Answer'], chat_history_rows(rows), 'chat_history.csv')
 
 
 def delete_student(request, student_id):
@@ -340,7 +698,16 @@ def delete_student(request, student_id):
     try:
         student = Student.objects.get(id=student_id)
         student_name = student.name
-        student.delete()
+        pk = student.pk
+        # The cascaded attendance rows leave the rollups in the same transaction
+        with transaction.atomic():
+            student.delete()
+        from .thumbnails import delete_thumbnails
+        delete_thumbnails(pk)
+        invalidate_students()
+        # Deleting the enrolment photo too keeps the next load() from re-adding the template
+        from .gallery import get_gallery, get_known_faces_dir
+        get_gallery().remove(student.student_id, get_known_faces_dir())
         messages.success(request, f"Student {student_name} has been deleted successfully.")
     except Student.DoesNotExist:
         messages.error(request, "Student not found.")
@@ -355,7 +722,8 @@ def delete_attendance(request, attendance_id):
         attendance = Attendance.objects.get(id=attendance_id)
         student_name = attendance.student.name
         date = attendance.date
-        attendance.delete()
+        with transaction.atomic():
+            attendance.delete()
         messages.success(request, f"Attendance record for {student_name} on {date} has been deleted successfully.")
     except Attendance.DoesNotExist:
         messages.error(request, "Attendance record not found.")
@@ -368,12 +736,14 @@ def reset_database(request):
     """Reset the entire database (delete all students and attendance records)"""
     if request.method == 'POST':
         try:
-            # Delete all attendance records first
+            # Delete all attendance records and students; the rollups are
+            # rebuilt once at the end rather than counted down row by row
             attendance_count = Attendance.objects.all().count()
-            Attendance.objects.all().delete()
-            
-            # Delete all students and their photos
             student_count = Student.objects.all().count()
+            with transaction.atomic(), rollups.suspended():
+                Attendance.objects.all().delete()
+                Student.objects.all().delete()
+                rollups.rebuild()
             
             # Delete student photos from known_faces directory
             base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -385,8 +755,14 @@ def reset_database(request):
                     except Exception as e:
                         print(f"Error deleting file {filename}: {e}")
             
-            # Delete all students from database
-            Student.objects.all().delete()
+            from .thumbnails import delete_all_thumbnails
+            delete_all_thumbnails()
+            from .gallery import get_gallery
+            get_gallery().clear()
+            get_marked_today().clear()
+            invalidate_students()
+            invalidate_attendance_dates()
+            bump_data_version()
             
             messages.success(request, f"Successfully reset database: deleted {attendance_count} attendance records and {student_count} students.")
         except Exception as e:
@@ -419,16 +795,26 @@ def register(request):
                 email=email,
                 photo=photo
             )
+            invalidate_students()
 
-            # Save photo to known_faces for recognition
             if photo:
+                # The dashboard shows a small thumbnail instead of the full photo
+                try:
+                    from .thumbnails import make_thumbnail
+                    make_thumbnail(student)
+                except Exception as e:
+                    print(f"Error creating thumbnail for {student_id}: {e}")
+
+                # Save photo to known_faces for recognition
                 try:
                     from .face_utils import save_student_photo
+                    from .gallery import get_gallery
                     from PIL import Image
-                    import io
                     photo.seek(0)
                     img = Image.open(photo)
                     save_student_photo(img, student_id)
+                    if not get_gallery().add(student_id, img):
+                        print(f"No face found in photo for {student_id}")
                 except Exception as e:
                     print(f"Error saving photo to known_faces: {e}")
             
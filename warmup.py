@@ -0,0 +1,76 @@
+"""Load the face detector, gallery and recognition workers before the first request"""
+import os
+import sys
+import time
+
+from django.conf import settings
+
+# Programs that serve requests; anything else run through manage.py is a one-off command
+SERVER_PROGRAMS = ('gunicorn', 'uvicorn', 'daphne', 'hypercorn', 'uwsgi', 'waitress')
+
+
+def is_serving():
+    """True in a process that is about to serve requests"""
+    if os.environ.get('RUN_MAIN') == 'true':
+        # runserver's autoreloaded child, the process that actually serves
+        return True
+    program = sys.argv[0] if sys.argv else ''
+    if any(name in program for name in SERVER_PROGRAMS):
+        return True
+    return 'runserver' in sys.argv and '--noreload' in sys.argv
+
+
+def warm_up():
+    """Import the heavy modules and load everything the first recognition needs; returns {step: seconds}"""
+    timings = {}
+
+    def step(name, started):
+        timings[name] = time.perf_counter() - started
+        return time.perf_counter()
+
+    started = time.perf_counter()
+    import cv2
+    import numpy as np
+    from django.urls import get_resolver
+    from .engine import get_engine
+    from .frames import prepare_frame
+    from .encoders import get_encoder
+    from .gallery import get_gallery
+    # Resolving the URLconf imports urls.py and views.py
+    get_resolver().url_patterns
+    started = step('imports', started)
+
+    # Loads the encoder's models (the Haar cascade, or face_recognition's dlib models)
+    encoder = get_encoder()
+    blank = np.zeros((120, 160, 3), np.uint8)
+    encoder.locate(blank)
+    started = step('detector', started)
+
+    gallery = get_gallery()
+    if len(gallery):
+        # Touches the matrix and, in ann mode, builds the partitioned index
+        gallery.search(np.zeros(encoder.dimension, np.float32))
+    started = step('gallery', started)
+
+    # One task per worker starts every thread and runs the decode/detect path once on each
+    engine = get_engine()
+    frame = cv2.imencode('.jpg', blank)[1].tobytes()
+    tasks = [engine.submit(lambda: encoder.locate(prepare_frame(frame).image)) for _ in range(engine.workers)]
+    for task in tasks:
+        task.result()
+    step('workers', started)
+    return timings
+
+
+def maybe_warm_up():
+    """Warm up per FACE_WARMUP: True always, False never, unset only when serving"""
+    enabled = getattr(settings, 'FACE_WARMUP', None)
+    if enabled is False or (enabled is None and not is_serving()):
+        return
+    try:
+        timings = warm_up()
+    except Exception as e:
+        print(f"Recognition warm-up failed, the first request will load lazily: {e}")
+        return
+    details = ', '.join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in timings.items())
+    print(f"Recognition warm-up done in {sum(timings.values()):.2f}s ({details})")